@@ -0,0 +1,81 @@
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks import load_test
+
+# Starts the TorchServe stand-in and the gateway, then load tests the gateway.
+# The gateway talks to TorchServe on localhost when API_DOMAIN is not
+# "localhost", so the stand-in is reachable without the docker network.
+
+
+def wait_for(url: str, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout} seconds")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the gateway against a local TorchServe stand-in"
+    )
+    load_test.add_arguments(parser)
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    args.url = f"http://localhost:{args.port}"
+
+    stub = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.stub_torchserve",
+            "--latency",
+            str(args.latency),
+            "--jitter",
+            str(args.jitter),
+            "--error-rate",
+            str(args.error_rate),
+        ],
+        stdout=subprocess.DEVNULL,
+    )
+    gateway = None
+    try:
+        wait_for("http://127.0.0.1:8080/ping", 30)
+        environment = {
+            **os.environ,
+            "API_DOMAIN": os.environ.get("API_DOMAIN", "benchmark.local"),
+            "UVICORN_PORT": str(args.port),
+            "TORCHSERVE_STARTUP_RETRY_DELAY": "0.5",
+        }
+        gateway = subprocess.Popen(
+            [sys.executable, "-m", "crop_health_api"],
+            env=environment,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        wait_for(f"{args.url}/ping", 60)
+        args.gateway_pid = gateway.pid
+        asyncio.run(load_test.run(args))
+    finally:
+        for process in (gateway, stub):
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+
+if __name__ == "__main__":
+    main()
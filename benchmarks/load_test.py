@@ -0,0 +1,183 @@
+import argparse
+import asyncio
+import io
+import os
+import statistics
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from httpx import AsyncClient, Limits, Timeout
+from PIL import Image
+
+
+@dataclass
+class LevelResult:
+    concurrency: int
+    requests: int
+    errors: int
+    duration: float
+    latencies: list[float] = field(default_factory=list)
+    peak_rss: int | None = None
+
+    @property
+    def throughput(self) -> float:
+        return self.requests / self.duration
+
+    def percentile(self, q: int) -> float:
+        if len(self.latencies) < 2:
+            return self.latencies[0] if self.latencies else 0.0
+        return statistics.quantiles(self.latencies, n=100, method="inclusive")[q - 1]
+
+
+def synthetic_image(width: int, height: int) -> bytes:
+    # Noise compresses badly, so the picture is about as large as a photo
+    image = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    output = io.BytesIO()
+    image.save(output, "JPEG", quality=90)
+    return output.getvalue()
+
+
+def rss(pid: int) -> int | None:
+    # Resident memory of a process in bytes, only available on Linux
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+async def sample_memory(pid: int, result: LevelResult, stop: asyncio.Event):
+    while not stop.is_set():
+        current = rss(pid)
+        if current is not None:
+            result.peak_rss = max(result.peak_rss or 0, current)
+        try:
+            await asyncio.wait_for(stop.wait(), 0.1)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_level(
+    client: AsyncClient,
+    url: str,
+    image: bytes,
+    concurrency: int,
+    requests: int,
+    unique: bool,
+    gateway_pid: int | None,
+) -> LevelResult:
+    result = LevelResult(concurrency, requests, 0, 0.0)
+    queue = asyncio.Queue()
+    for index in range(requests):
+        queue.put_nowait(index)
+
+    async def worker():
+        while not queue.empty():
+            queue.get_nowait()
+            # Random trailing bytes make every upload unique to defeat the
+            # gateway cache, across levels and across runs
+            body = image + os.urandom(16) if unique else image
+            start = time.perf_counter()
+            try:
+                response = await client.post(url, content=body)
+                if response.status_code != 200:
+                    result.errors += 1
+            except Exception:
+                result.errors += 1
+            result.latencies.append(time.perf_counter() - start)
+
+    stop = asyncio.Event()
+    sampler = None
+    if gateway_pid is not None:
+        sampler = asyncio.create_task(sample_memory(gateway_pid, result, stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result.duration = time.perf_counter() - start
+    stop.set()
+    if sampler is not None:
+        await sampler
+    return result
+
+
+def report(results: list[LevelResult]):
+    header = (
+        f"{'concurrency':>11} {'requests':>8} {'errors':>6} {'req/s':>8} "
+        f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'peak RSS MiB':>12}"
+    )
+    print(header)
+    for result in results:
+        peak_rss = (
+            f"{result.peak_rss / 1024 / 1024:.1f}"
+            if result.peak_rss is not None
+            else "n/a"
+        )
+        print(
+            f"{result.concurrency:>11} {result.requests:>8} {result.errors:>6} "
+            f"{result.throughput:>8.1f} {result.percentile(50) * 1000:>8.1f} "
+            f"{result.percentile(95) * 1000:>8.1f} {result.percentile(99) * 1000:>8.1f} "
+            f"{peak_rss:>12}"
+        )
+
+
+async def run(args) -> list[LevelResult]:
+    if args.image:
+        image = Path(args.image).read_bytes()
+    else:
+        image = synthetic_image(args.width, args.height)
+    url = args.url.rstrip("/") + args.route
+    max_concurrency = max(args.concurrency)
+    results = []
+    async with AsyncClient(
+        limits=Limits(max_connections=max_concurrency),
+        timeout=Timeout(args.timeout),
+    ) as client:
+        for concurrency in args.concurrency:
+            results.append(
+                await run_level(
+                    client,
+                    url,
+                    image,
+                    concurrency,
+                    args.requests,
+                    not args.repeat_image,
+                    args.gateway_pid,
+                )
+            )
+    report(results)
+    return results
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--route", default="/predictions/binary")
+    parser.add_argument(
+        "--concurrency",
+        type=lambda value: [int(level) for level in value.split(",")],
+        default=[1, 8, 32],
+        help="Comma-separated concurrency levels",
+    )
+    parser.add_argument(
+        "--requests", type=int, default=200, help="Requests per concurrency level"
+    )
+    parser.add_argument("--image", help="Picture to upload, synthetic by default")
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument(
+        "--repeat-image",
+        action="store_true",
+        help="Upload the exact same bytes every time, so the gateway cache hits",
+    )
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument(
+        "--gateway-pid", type=int, help="Process of the gateway to sample memory of"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the crop health API")
+    add_arguments(parser)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,166 @@
+import argparse
+import asyncio
+import json
+import random
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+# Classes predicted by each model, see the response schemas in custom_openapi
+MODEL_CLASSES = {
+    "binary": ["HLT", "NOT_HLT"],
+    "single-HLT": [
+        "HLT",
+        "CBSD",
+        "CMD",
+        "MLN",
+        "MSV",
+        "FAW",
+        "MLB",
+        "BR",
+        "ALS",
+        "BS",
+        "FW",
+        "ANT",
+        "CSSVD",
+    ],
+    "multi-HLT": [
+        "HLT_cassava",
+        "CBSD_cassava",
+        "CMD_cassava",
+        "MLN_maize",
+        "HLT_maize",
+        "MSV_maize",
+        "FAW_maize",
+        "MLB_maize",
+        "HLT_beans",
+        "BR_beans",
+        "ALS_beans",
+        "HLT_bananas",
+        "BS_bananas",
+        "FW_bananas",
+        "HLT_cocoa",
+        "ANT_cocoa",
+        "CSSVD_cocoa",
+    ],
+}
+
+OPENAPI = {
+    "openapi": "3.0.1",
+    "info": {"title": "TorchServe APIs", "version": "0.11.0"},
+    "paths": {
+        "/ping": {
+            "get": {
+                "description": "Get TorchServe status.",
+                "operationId": "ping",
+                "responses": {
+                    "200": {
+                        "description": "TorchServe status",
+                        "content": {
+                            "application/json": {
+                                "schema": {
+                                    "type": "object",
+                                    "required": ["status"],
+                                    "properties": {
+                                        "status": {
+                                            "type": "string",
+                                            "description": "Overall status of the TorchServe.",
+                                        }
+                                    },
+                                }
+                            }
+                        },
+                    }
+                },
+            }
+        },
+        "/predictions/{model_name}": {"post": {"responses": {}}},
+    },
+}
+
+
+def error(code: int, type: str, message: str):
+    return JSONResponse(
+        {"code": code, "type": type, "message": message}, status_code=code
+    )
+
+
+def create_app(latency: float, jitter: float, error_rate: float) -> FastAPI:
+    # Mimics the parts of TorchServe the gateway talks to, answering
+    # predictions with random confidences after a configurable latency
+    app = FastAPI(openapi_url=None, docs_url=None, redoc_url=None)
+
+    @app.options("/")
+    async def api_description():
+        return OPENAPI
+
+    @app.get("/ping")
+    async def ping():
+        return {"status": "Healthy"}
+
+    @app.get("/models/{model_name}")
+    async def describe_model(model_name: str):
+        if model_name not in MODEL_CLASSES:
+            return error(
+                404, "ModelNotFoundException", f"Model not found: {model_name}"
+            )
+        return [{"modelName": model_name, "modelVersion": "1.0", "workers": []}]
+
+    @app.post("/predictions/{model_name}")
+    async def predictions(model_name: str, request: Request):
+        if model_name not in MODEL_CLASSES:
+            return error(
+                404, "ModelNotFoundException", f"Model not found: {model_name}"
+            )
+        await request.body()
+        await asyncio.sleep(max(random.gauss(latency, jitter), 0))
+        if random.random() < error_rate:
+            return error(
+                503,
+                "ServiceUnavailableException",
+                "Model is not ready or the job queue is full",
+            )
+        confidences = [random.random() for _ in MODEL_CLASSES[model_name]]
+        total = sum(confidences)
+        prediction = {
+            name: confidence / total
+            for name, confidence in zip(MODEL_CLASSES[model_name], confidences)
+        }
+        return dict(sorted(prediction.items(), key=lambda item: -item[1]))
+
+    return app
+
+
+async def serve(args):
+    app = create_app(args.latency, args.jitter, args.error_rate)
+    servers = [
+        uvicorn.Server(
+            uvicorn.Config(app, host=args.host, port=port, log_level="warning")
+        )
+        for port in (args.inference_port, args.management_port)
+    ]
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="TorchServe stand-in for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--inference-port", type=int, default=8080)
+    parser.add_argument("--management-port", type=int, default=8081)
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="Mean prediction latency (s)"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.01, help="Deviation of the latency (s)"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="Share of predictions failing"
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    print(json.dumps(vars(arguments)))
+    asyncio.run(serve(arguments))
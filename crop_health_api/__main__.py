@@ -1,67 +1,107 @@
 import asyncio
+import logging
 import pathlib
 from contextlib import asynccontextmanager
 
-import requests
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.openapi.docs import get_swagger_ui_html
-from fastapi.responses import HTMLResponse
-
-from crop_health_api.custom_openapi import custom_openapi_gen
+from fastapi.responses import (
+    HTMLResponse,
+    JSONResponse,
+    ORJSONResponse,
+    Response,
+    StreamingResponse,
+)
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from crop_health_api import deadline, metrics, preprocessing, torchserve, warmup
+from crop_health_api.autoscaler import autoscaler
+from crop_health_api.encoded_document import EncodedDocument
+from crop_health_api.jobs import JobQueueFull
+from crop_health_api.jobs import manager as job_manager
+from crop_health_api.model_registry import reconciler
+from crop_health_api.openapi_artifact import build_openapi, load_artifact
+from crop_health_api.predictions import (
+    predict,
+    predict_all,
+    predict_batch,
+    stream_batch,
+)
+from crop_health_api.request_body import (
+    InvalidBatch,
+    RequestBodyTooLarge,
+    check_content_length,
+    read_body,
+    read_images,
+    stream_body,
+)
 from crop_health_api.settings import settings
-from httpx import AsyncClient
 
-example_code_dir = pathlib.Path(__file__).parent / "example_code"
-openapi_json_cache = None
+# The package logger, as this module runs as __main__
+logger = logging.getLogger("crop_health_api")
+
+openapi_document = None
+
+
+def configure_logging():
+    # uvicorn only configures its own loggers, so the gateway's would be
+    # dropped unless the application has set up logging itself
+    if not logger.hasHandlers():
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(levelname)s:     %(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+
+
+async def wait_for_torchserve(max_retries: int | None):
+    # Try to reach TorchServe's /ping endpoint with retries
+    if await torchserve.pool.wait_until_healthy(
+        max_retries, settings.torchserve_startup_retry_delay
+    ):
+        logger.info("TorchServe is up and running!")
+        await torchserve.load_model_versions()
+        # Applied before the warm-up, which then runs with the final settings
+        await reconciler.reconcile(startup=True)
+        await warmup.warm_up(max_retries)
 
 
 @asynccontextmanager
 async def app_lifespan(app):
-    global openapi_json_cache
-    # Try to reach TorchServe's /ping endpoint with retries
-    # If running docker containers locally, use "http://local_torchserve:8080" given
-    # that "local_torchserve" is the name of the container running custom TorchServe
-    max_retries = 10
-    retry_delay = 5  # seconds
-    for _ in range(max_retries):
-        try:
-            response = requests.get(f"http://{torchserve_domain()}:8080/ping")
-            if response.status_code == 200:
-                print("TorchServe is up and running!")
-                break
-            else:
-                raise Exception(
-                    f"TorchServe is not ready. Status code: {response.status_code}"
-                )
-        except (requests.exceptions.ConnectionError, Exception) as e:
-            print(
-                f"Waiting for TorchServe to be available: {e}. Retrying in {retry_delay} seconds."
-            )
-            await asyncio.sleep(retry_delay)
-    response = requests.options(f"http://{torchserve_domain()}:8080", timeout=10)
-    if response.status_code == 200:
-        openapi_json = response.json()
-        # Remove specific endpoints if needed
-        endpoints_to_keep = ["/ping"]
-        all_endpoints = list(openapi_json["paths"].keys())
-        for endpoint in all_endpoints:
-            if endpoint not in endpoints_to_keep:
-                del openapi_json["paths"][endpoint]
-
-        # Initializing custom endpoints we want to show in the openapi docs
-        custom_endpoints = [
-            "/predictions/binary",
-            "/predictions/single-HLT",
-            "/predictions/multi-HLT",
-        ]
-        for endpoint in custom_endpoints:
-            openapi_json["paths"][endpoint] = {"post": {"responses": {}}}
-
-        openapi_json = custom_openapi_gen(openapi_json, example_code_dir)
-        openapi_json_cache = openapi_json
+    global openapi_document
+    configure_logging()
+    client = torchserve.open_client()
+    startup = None
+    openapi_json = load_artifact(pathlib.Path(settings.openapi_artifact))
+    if openapi_json is not None:
+        # Generated at build time, so startup does not wait for TorchServe.
+        # It keeps waiting in the background, however long the models take to
+        # load, as model versions are needed for the prediction cache.
+        startup = asyncio.create_task(wait_for_torchserve(None))
     else:
-        raise Exception("Failed to load OpenAPI JSON from TorchServe")
-    yield
+        await wait_for_torchserve(settings.torchserve_startup_retries)
+        if not warmup.ready:
+            # /ping reports not ready until the models have been warmed up
+            startup = asyncio.create_task(warmup.warm_up(None))
+        response = await client.options(torchserve.inference_url(), timeout=10)
+        if response.status_code != 200:
+            raise Exception("Failed to load OpenAPI JSON from TorchServe")
+        openapi_json = build_openapi(response.json())
+    # Serialized and compressed once, the docs pages fetch it constantly
+    openapi_document = EncodedDocument.from_json(openapi_json)
+    preprocessing.start()
+    job_manager.start()
+    autoscaler.start()
+    reconciler.start()
+    try:
+        yield
+    finally:
+        if startup is not None:
+            startup.cancel()
+        await reconciler.stop()
+        await autoscaler.stop()
+        await job_manager.stop()
+        preprocessing.stop()
+        await torchserve.close_client()
 
 
 app = FastAPI(
@@ -69,12 +109,13 @@ app = FastAPI(
     lifespan=app_lifespan,
     root_path=settings.api_root_path,
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
 
 @app.get("/openapi.json")
-async def get_openapi_json():
-    if openapi_json_cache:
-        return openapi_json_cache
+async def get_openapi_json(request: Request):
+    if openapi_document:
+        return openapi_document.response(request)
     else:
         raise HTTPException(status_code=500, detail="OpenAPI JSON is not loaded")
 
@@ -103,15 +144,25 @@ async def docs():
     )
 
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.get("/ping")
 async def ping():
-    try:
-        response = requests.get(f"http://{torchserve_domain()}:8080/ping")
-        if response.status_code != 200:
-            raise HTTPException(status_code=response.status_code, detail=response.text)
-        return response.json()
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    # Answered from the result of the background health check
+    status = torchserve.pool.status()
+    headers = {}
+    if status.checked_at is not None:
+        headers["X-Health-Checked-At"] = str(status.checked_at)
+    if not torchserve.pool.healthy:
+        raise HTTPException(status_code=503, detail=status.detail, headers=headers)
+    if not warmup.ready:
+        raise HTTPException(
+            status_code=503, detail="TorchServe is warming up", headers=headers
+        )
+    return JSONResponse(status.body, headers=headers)
 
 
 @app.post("/predictions/single-HLT")
@@ -129,37 +180,126 @@ async def binary(request: Request):
     return await torch_request(request, "binary")
 
 
-async def torch_request(request: Request, type):
-    try:
-        # Get file
-        file_content = await request.body()
-
-        async with AsyncClient() as client:
-            response = await client.post(
-                f"http://{torchserve_domain()}:8080/predictions/{type}",
-                files={"data": file_content},
+@app.post("/predictions/all")
+async def all_models(request: Request, models: str | None = None):
+    selected = list(torchserve.MODELS)
+    if models is not None:
+        names = [model.strip() for model in models.split(",") if model.strip()]
+        selected = list(dict.fromkeys(names))
+        unknown = [model for model in selected if model not in torchserve.MODELS]
+        if unknown:
+            raise HTTPException(
+                status_code=400, detail=f"Unknown models: {', '.join(unknown)}"
             )
+        if not selected:
+            raise HTTPException(status_code=400, detail="No models selected")
+    deadline.start(request.headers.get("X-Request-Timeout"))
+    try:
+        file_content = await read_body(request)
+    except RequestBodyTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return ORJSONResponse(await predict_all(file_content, selected))
+
+
+@app.post("/predictions/batch")
+async def batch(request: Request, model: str):
+    if model not in torchserve.MODELS:
+        raise HTTPException(status_code=400, detail=f"Unknown model: {model}")
+    # A batch may take much longer than a single prediction, so it only has a
+    # deadline when the client asks for one
+    if "X-Request-Timeout" in request.headers:
+        deadline.start(request.headers["X-Request-Timeout"])
+    try:
+        images = await read_images(request)
+    except RequestBodyTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidBatch as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Results streamed as each picture is done, rather than all at the end
+    if "application/x-ndjson" in request.headers.get("accept", ""):
+        return StreamingResponse(
+            stream_batch(images, model), media_type="application/x-ndjson"
+        )
+    return ORJSONResponse(await predict_batch(images, model))
+
+
+@app.post("/jobs", status_code=202)
+async def create_job(request: Request, model: str):
+    if model not in torchserve.MODELS:
+        raise HTTPException(status_code=400, detail=f"Unknown model: {model}")
+    try:
+        images = await read_images(request)
+        job = job_manager.create(model, images)
+    except RequestBodyTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidBatch as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except JobQueueFull as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(settings.admission_retry_after)},
+        )
+    return ORJSONResponse(job.summary(), status_code=202)
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return ORJSONResponse(job.summary())
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return ORJSONResponse(job.summary())
 
-        # Send the file to TorchServe
-
-        # Check if the request was successful
-        if response.status_code != 200:
-            raise HTTPException(status_code=response.status_code, detail=response.text)
 
-        # Return the response from TorchServe
-        return response.json()
+async def torch_request(request: Request, type):
+    deadline.start(request.headers.get("X-Request-Timeout"))
+    try:
+        if settings.torchserve_stream_request_body:
+            # Forward the raw body as it arrives, TorchServe accepts it as is
+            headers = {
+                "content-type": request.headers.get(
+                    "content-type", "application/octet-stream"
+                )
+            }
+            if "content-length" in request.headers:
+                headers["content-length"] = request.headers["content-length"]
+            # Before taking an admission slot and a connection to TorchServe
+            check_content_length(request, settings.max_request_body_size)
+            # The body is never held in full, so the prediction cache is bypassed
+            response = await torchserve.infer_stream(
+                type, stream_body(request), headers
+            )
+            if response.status_code != 200:
+                raise HTTPException(
+                    status_code=response.status_code, detail=response.text
+                )
+            return Response(
+                response.content,
+                media_type=response.headers.get("content-type", "application/json"),
+            )
 
+        # Get file
+        file_content = await read_body(request)
+        # TorchServe's response is passed through as is
+        prediction = await predict(file_content, type)
+        return Response(prediction.content, media_type=prediction.media_type)
+
+    except RequestBodyTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-def torchserve_domain():
-    if settings.api_domain == "localhost":
-        return "local_torchserve"
-    else:
-        return "localhost"
-
-
 if __name__ == "__main__":
     import uvicorn
 
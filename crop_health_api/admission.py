@@ -0,0 +1,80 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+
+from crop_health_api import metrics
+from crop_health_api.settings import settings
+
+
+class Overloaded(HTTPException):
+    def __init__(self, model: str, reason: str):
+        super().__init__(
+            status_code=503,
+            detail=f"Model {model} is overloaded: {reason}",
+            headers={"Retry-After": str(settings.admission_retry_after)},
+        )
+
+
+class AdmissionController:
+    # Limits the number of concurrent requests sent to TorchServe for a model.
+    # Requests beyond the limit wait in a bounded queue, and are rejected when
+    # the queue is full or when they have waited too long.
+
+    def __init__(self, model: str, max_concurrency: int, max_queue: int):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiting = 0
+        # Moving average of the time admitted requests take, in seconds
+        self.latency = 0.0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    @asynccontextmanager
+    async def admit(self):
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                metrics.ADMISSION_REJECTED.labels(self.model, "queue_full").inc()
+                raise Overloaded(self.model, "the queue is full")
+            self.waiting += 1
+            metrics.ADMISSION_QUEUE_DEPTH.labels(self.model).inc()
+            try:
+                await asyncio.wait_for(
+                    self._semaphore.acquire(), settings.admission_queue_timeout
+                )
+            except asyncio.TimeoutError:
+                metrics.ADMISSION_REJECTED.labels(self.model, "queue_timeout").inc()
+                raise Overloaded(self.model, "timed out waiting in the queue")
+            finally:
+                self.waiting -= 1
+                metrics.ADMISSION_QUEUE_DEPTH.labels(self.model).dec()
+        else:
+            await self._semaphore.acquire()
+
+        self.active += 1
+        metrics.ADMISSION_ACTIVE.labels(self.model).inc()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.latency += 0.2 * (time.perf_counter() - start - self.latency)
+            self.active -= 1
+            metrics.ADMISSION_ACTIVE.labels(self.model).dec()
+            self._semaphore.release()
+
+
+controllers: dict[str, AdmissionController] = {}
+
+
+def controller(model: str) -> AdmissionController:
+    if model not in controllers:
+        controllers[model] = AdmissionController(
+            model,
+            settings.admission_model_concurrency.get(
+                model, settings.admission_max_concurrency
+            ),
+            settings.admission_max_queue,
+        )
+    return controllers[model]
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import math
+import time
+
+from crop_health_api import admission, metrics, torchserve
+from crop_health_api.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Weight of the latest sample in the moving average of the demand
+SMOOTHING = 0.5
+
+
+class Autoscaler:
+    # Scales the TorchServe workers of each model with its demand, the number
+    # of requests running or queued in the gateway. Models get workers from a
+    # shared budget, so busy models take the cores that idle models give back.
+    # Scaling up is immediate, scaling down waits for the model to have been
+    # quiet for autoscale_scale_down_delay seconds.
+
+    def __init__(self):
+        self.workers: dict[str, int] = {}
+        self.demand: dict[str, float] = {}
+        # Last time each model needed all of its workers
+        self.needed_at: dict[str, float] = {}
+        self._task: asyncio.Task | None = None
+
+    def desired(self, model: str) -> int:
+        controller = admission.controller(model)
+        wanted = math.ceil(self.demand[model] / settings.autoscale_target_concurrency)
+        # Requests queueing while responses are slow need more workers than
+        # the concurrency alone suggests
+        if (
+            controller.waiting
+            and controller.latency > settings.autoscale_target_latency
+        ):
+            wanted = max(wanted, self.workers[model] + 1)
+        return min(
+            max(wanted, settings.autoscale_min_workers), settings.autoscale_max_workers
+        )
+
+    def allocate(self, now: float) -> dict[str, int]:
+        wanted = {model: self.desired(model) for model in torchserve.MODELS}
+        allocation = {}
+        for model in torchserve.MODELS:
+            if wanted[model] >= self.workers[model]:
+                self.needed_at[model] = now
+            # Workers of models that were busy recently are not given away yet
+            if now - self.needed_at[model] < settings.autoscale_scale_down_delay:
+                allocation[model] = self.workers[model]
+            else:
+                allocation[model] = settings.autoscale_min_workers
+        budget = settings.autoscale_max_total_workers - sum(allocation.values())
+        # The budget goes one worker at a time to the model that would have the
+        # most demand per worker with it
+        while budget > 0:
+            short = [model for model in allocation if allocation[model] < wanted[model]]
+            if not short:
+                break
+            model = max(
+                short, key=lambda model: self.demand[model] / (allocation[model] + 1)
+            )
+            allocation[model] += 1
+            budget -= 1
+        return allocation
+
+    async def read_workers(self, model: str):
+        response = await torchserve.get_client().get(
+            torchserve.management_url(f"/models/{model}")
+        )
+        response.raise_for_status()
+        self.workers[model] = response.json()[0]["minWorkers"]
+        metrics.AUTOSCALE_WORKERS.labels(model).set(self.workers[model])
+
+    async def scale(self, model: str, workers: int):
+        logger.info(
+            "Scaling workers of model %s from %s to %s",
+            model,
+            self.workers[model],
+            workers,
+        )
+        for backend in torchserve.pool.backends:
+            response = await torchserve.get_client().put(
+                backend.management_url(f"/models/{model}"),
+                params={"min_worker": workers, "max_worker": workers},
+            )
+            response.raise_for_status()
+        self.workers[model] = workers
+        metrics.AUTOSCALE_WORKERS.labels(model).set(workers)
+
+    async def tick(self):
+        now = time.monotonic()
+        for model in torchserve.MODELS:
+            if model not in self.workers:
+                await self.read_workers(model)
+                self.needed_at[model] = now
+            controller = admission.controller(model)
+            load = controller.active + controller.waiting
+            demand = self.demand.get(model, load)
+            self.demand[model] = demand + SMOOTHING * (load - demand)
+        for model, workers in self.allocate(now).items():
+            if workers != self.workers[model]:
+                await self.scale(model, workers)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.autoscale_interval)
+            try:
+                await self.tick()
+            except Exception as e:
+                logger.warning("Could not autoscale TorchServe workers: %r", e)
+
+    def start(self):
+        if settings.autoscale_enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+autoscaler = Autoscaler()
@@ -0,0 +1,155 @@
+import asyncio
+import itertools
+import logging
+import random
+from typing import Callable
+
+from httpx import AsyncClient
+
+from crop_health_api import metrics
+from crop_health_api.grpc_transport import GrpcClient
+from crop_health_api.health import HealthMonitor, HealthStatus
+from crop_health_api.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Backend:
+    # A TorchServe instance, health-checked in the background. It is ejected
+    # when its health check fails, or after repeated failed requests until its
+    # next successful health check.
+
+    def __init__(
+        self, address: str, client: Callable[[], AsyncClient], weight: float = 1.0
+    ):
+        host, _, port = address.partition(":")
+        self.address = address
+        self.host = host
+        self.port = int(port or 8080)
+        self.weight = weight
+        self.outstanding = 0
+        self.failures = 0
+        self.ejected_at: float | None = None
+        # Taken out of rotation while its models are being registered again
+        self.draining = False
+        # Version of each model it serves, read from its management API
+        self.model_versions: dict[str, str] = {}
+        self.grpc: GrpcClient | None = None
+        self.monitor = HealthMonitor(lambda: self.inference_url("/ping"), client)
+        metrics.BACKEND_AVAILABLE.labels(address).set_function(lambda: self.available)
+
+    def inference_url(self, path: str = "") -> str:
+        return f"http://{self.host}:{self.port}{path}"
+
+    def management_url(self, path: str = "") -> str:
+        return f"http://{self.host}:{settings.torchserve_management_port}{path}"
+
+    @property
+    def available(self) -> bool:
+        if self.draining or not self.monitor.healthy:
+            return False
+        if self.ejected_at is not None:
+            if self.monitor.status.checked_at <= self.ejected_at:
+                return False
+            # Re-admitted by a health check made after the ejection
+            logger.info("Re-admitting TorchServe backend %s", self.address)
+            self.ejected_at = None
+            self.failures = 0
+        return True
+
+    @property
+    def load(self) -> float:
+        return self.outstanding / self.weight
+
+    def record(self, success: bool):
+        if success:
+            self.failures = 0
+            return
+        self.failures += 1
+        if self.failures >= settings.backend_max_failures and self.ejected_at is None:
+            logger.warning(
+                "Ejecting TorchServe backend %s after %s failures",
+                self.address,
+                self.failures,
+            )
+            self.ejected_at = self.monitor.status.checked_at or 0.0
+
+
+class BackendPool:
+    def __init__(self, backends: list[Backend]):
+        self.backends = backends
+
+    @property
+    def primary(self) -> Backend:
+        return self.backends[0]
+
+    def select(self, exclude: list[Backend] | None = None) -> Backend:
+        # Backends in exclude are only used when there is no other choice
+        exclude = exclude or []
+        available = [backend for backend in self.backends if backend.available]
+        # When no backend is known to be available, try them all rather than
+        # failing every request
+        candidates = (
+            [b for b in available if b not in exclude]
+            or [b for b in self.backends if b not in exclude and not b.draining]
+            or available
+            or self.backends
+        )
+        if len(candidates) == 1:
+            return candidates[0]
+        if settings.backend_routing == "weighted":
+            return random.choices(
+                candidates, weights=[backend.weight for backend in candidates]
+            )[0]
+        if settings.backend_routing == "power_of_two":
+            candidates = random.sample(candidates, 2)
+        lowest = min(backend.load for backend in candidates)
+        return random.choice(
+            [backend for backend in candidates if backend.load == lowest]
+        )
+
+    @property
+    def healthy(self) -> bool:
+        return any(backend.monitor.healthy for backend in self.backends)
+
+    def status(self) -> HealthStatus:
+        # Status of a healthy backend, or the most recent one if none is
+        healthy = [b.monitor.status for b in self.backends if b.monitor.healthy]
+        if healthy:
+            return healthy[0]
+        return max(
+            (backend.monitor.status for backend in self.backends),
+            key=lambda status: status.checked_at or 0.0,
+        )
+
+    async def wait_until_healthy(
+        self, max_retries: int | None, retry_delay: float
+    ) -> bool:
+        # Waits forever when max_retries is None
+        attempts = itertools.count() if max_retries is None else range(max_retries)
+        for _ in attempts:
+            await asyncio.gather(*(b.monitor.check() for b in self.backends))
+            if self.healthy:
+                return True
+            logger.warning(
+                "Waiting for TorchServe to be available: %s. Retrying in %s seconds.",
+                self.status().detail,
+                retry_delay,
+            )
+            await asyncio.sleep(retry_delay)
+        return False
+
+    def start(self):
+        for backend in self.backends:
+            backend.monitor.start()
+            if settings.torchserve_transport == "grpc":
+                backend.grpc = GrpcClient(
+                    f"{backend.host}:{settings.torchserve_grpc_port}"
+                )
+
+    async def stop(self):
+        for backend in self.backends:
+            await backend.monitor.stop()
+            if backend.grpc is not None:
+                await backend.grpc.close()
+                backend.grpc = None
@@ -0,0 +1,136 @@
+import logging
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+from fastapi import HTTPException
+
+from crop_health_api import metrics
+from crop_health_api.settings import settings
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+# Values of the circuit state gauge
+STATES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpen(HTTPException):
+    def __init__(self, model: str, retry_after: float):
+        super().__init__(
+            status_code=503,
+            detail=f"Model {model} is unavailable, TorchServe is failing",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+
+class Outcome:
+    # Set by the guarded code once it knows whether TorchServe failed
+    failed: bool | None = None
+
+
+# Outcome of the guarded request running in the current context, for the
+# code calling TorchServe to report failures the guarded code cannot see
+current_outcome: ContextVar[Outcome | None] = ContextVar(
+    "current_outcome", default=None
+)
+
+
+class CircuitBreaker:
+    # Stops sending requests for a model to TorchServe when too many of them
+    # fail. The circuit opens when the error rate over the last
+    # circuit_window seconds reaches circuit_error_rate, and requests then fail
+    # at once. After circuit_open_duration a few probe requests are let through
+    # (half-open), closing the circuit if they all succeed and opening it
+    # again as soon as one fails.
+
+    def __init__(self, model: str):
+        self.model = model
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probes = 0
+        self.successful_probes = 0
+        # (time, failed) of the requests in the window
+        self.outcomes: deque[tuple[float, bool]] = deque()
+        metrics.CIRCUIT_STATE.labels(model).set(STATES[CLOSED])
+
+    def _set_state(self, state: str):
+        logger.warning(
+            "Circuit for model %s changed from %s to %s", self.model, self.state, state
+        )
+        self.state = state
+        metrics.CIRCUIT_STATE.labels(self.model).set(STATES[state])
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        self.probes = 0
+        self.successful_probes = 0
+        self.outcomes.clear()
+
+    def _allow(self) -> bool:
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < settings.circuit_open_duration:
+                return False
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self.probes >= settings.circuit_half_open_probes:
+                return False
+            self.probes += 1
+        return True
+
+    def _record(self, failed: bool):
+        if self.state == HALF_OPEN:
+            if failed:
+                self._set_state(OPEN)
+            else:
+                self.successful_probes += 1
+                if self.successful_probes >= settings.circuit_half_open_probes:
+                    self._set_state(CLOSED)
+            return
+        if self.state == OPEN:
+            # Sent before the circuit opened
+            return
+        now = time.monotonic()
+        self.outcomes.append((now, failed))
+        while self.outcomes[0][0] < now - settings.circuit_window:
+            self.outcomes.popleft()
+        if len(self.outcomes) < settings.circuit_min_requests:
+            return
+        failures = sum(failed for _, failed in self.outcomes)
+        if failures / len(self.outcomes) >= settings.circuit_error_rate:
+            self._set_state(OPEN)
+
+    @asynccontextmanager
+    async def guard(self):
+        if not self._allow():
+            metrics.CIRCUIT_REJECTED.labels(self.model).inc()
+            raise CircuitOpen(
+                self.model,
+                settings.circuit_open_duration - (time.monotonic() - self.opened_at),
+            )
+        outcome = Outcome()
+        token = current_outcome.set(outcome)
+        try:
+            yield outcome
+        except BaseException:
+            # Requests failing for reasons of their own, like running out of
+            # time or being rejected by the gateway, leave a probe slot free
+            if outcome.failed is None and self.state == HALF_OPEN and self.probes:
+                self.probes -= 1
+            raise
+        finally:
+            current_outcome.reset(token)
+            if outcome.failed is not None:
+                self._record(outcome.failed)
+
+
+breakers: dict[str, CircuitBreaker] = {}
+
+
+def breaker(model: str) -> CircuitBreaker:
+    if model not in breakers:
+        breakers[model] = CircuitBreaker(model)
+    return breakers[model]
@@ -8,11 +8,17 @@ from crop_health_api.settings import settings
 supported_languages = {"cURL": "sh", "JavaScript": "js", "Python": "py"}
 
 
-def custom_openapi_gen(openapi_schema: dict, example_code_dir: Path):
+def custom_openapi_gen(
+    openapi_schema: dict,
+    example_code_dir: Path,
+    api_url: str | None = None,
+    version: str | None = None,
+):
+    api_url = api_url or settings.api_url
     openapi_schema["info"]["title"] = settings.title
-    openapi_schema["info"]["version"] = settings.version
+    openapi_schema["info"]["version"] = version or settings.version
     openapi_schema["info"]["description"] = settings.api_description
-    openapi_schema["servers"] = [{"url": settings.api_url}]
+    openapi_schema["servers"] = [{"url": api_url}]
 
     # Manually modify the schema for the /predictions/{model_name} endpoint
     endpoint_paths = [
@@ -132,6 +138,202 @@ def custom_openapi_gen(openapi_schema: dict, example_code_dir: Path):
                 },
             }
 
+    # The endpoint querying several models with a single upload
+    if "/predictions/all" in openapi_schema["paths"]:
+        openapi_schema["paths"]["/predictions/all"][method] = {
+            "description": "Health predictions by several models from a single upload "
+            "of the picture. The models are queried concurrently.",
+            "operationId": "predictions_with_all",
+            "parameters": [
+                {
+                    "name": "models",
+                    "in": "query",
+                    "required": False,
+                    "description": "Comma-separated list of the models to query. "
+                    "All models are queried by default.",
+                    "schema": {"type": "string", "example": "binary,single-HLT"},
+                }
+            ],
+            "requestBody": {
+                "description": "Picture of a plant.",
+                "content": {"*/*": {"schema": {"type": "string", "format": "binary"}}},
+                "required": "true",
+            },
+            "responses": {
+                "200": {
+                    "description": "The result of each queried model, keyed by "
+                    "model name.",
+                    "content": {
+                        "application/json": {
+                            "schema": {
+                                "$ref": "#/components/schemas/AllPredictionsResponse"
+                            }
+                        }
+                    },
+                },
+                "400": {"description": "Unknown model requested"},
+                "413": {"description": "Picture is too large"},
+            },
+        }
+
+    # The endpoint running many pictures through a model in one request
+    if "/predictions/batch" in openapi_schema["paths"]:
+        openapi_schema["paths"]["/predictions/batch"][method] = {
+            "description": "Health predictions by one model for many pictures in a "
+            "single request. The pictures are uploaded as multipart form files or as "
+            "a zip archive, and a picture that fails does not fail the whole batch.",
+            "operationId": "predictions_batch",
+            "parameters": [
+                {
+                    "name": "model",
+                    "in": "query",
+                    "required": True,
+                    "description": "The model to query.",
+                    "schema": {
+                        "type": "string",
+                        "enum": ["binary", "single-HLT", "multi-HLT"],
+                    },
+                }
+            ],
+            "requestBody": {
+                "description": "Pictures of plants.",
+                "content": {
+                    "multipart/form-data": {
+                        "schema": {
+                            "type": "object",
+                            "properties": {
+                                "files": {
+                                    "type": "array",
+                                    "items": {"type": "string", "format": "binary"},
+                                }
+                            },
+                        }
+                    },
+                    "application/zip": {
+                        "schema": {"type": "string", "format": "binary"}
+                    },
+                },
+                "required": "true",
+            },
+            "responses": {
+                "200": {
+                    "description": "The result for each picture, keyed by file name.",
+                    "content": {
+                        "application/json": {
+                            "schema": {
+                                "type": "object",
+                                "additionalProperties": {
+                                    "$ref": "#/components/schemas/ModelResult"
+                                },
+                                "example": {
+                                    "cocoa.jpg": {
+                                        "prediction": {"HLT": 0.85, "NOT_HLT": 0.15},
+                                        "elapsed_ms": 41.7,
+                                    },
+                                    "maize.jpg": {
+                                        "prediction": {"HLT": 0.12, "NOT_HLT": 0.88},
+                                        "elapsed_ms": 39.1,
+                                    },
+                                },
+                            }
+                        },
+                        "application/x-ndjson": {
+                            "schema": {
+                                "description": "With an Accept: application/x-ndjson "
+                                "header, one JSON line per picture as soon as its "
+                                "result is ready, in the order they complete. "
+                                "Closing the connection stops the remaining "
+                                "predictions.",
+                                "allOf": [
+                                    {"$ref": "#/components/schemas/ModelResult"},
+                                    {
+                                        "type": "object",
+                                        "properties": {
+                                            "index": {
+                                                "type": "integer",
+                                                "description": "Position of the "
+                                                "picture in the upload.",
+                                            },
+                                            "name": {
+                                                "type": "string",
+                                                "description": "File name of the "
+                                                "picture.",
+                                            },
+                                        },
+                                    },
+                                ],
+                                "example": {
+                                    "index": 1,
+                                    "name": "maize.jpg",
+                                    "prediction": {"HLT": 0.12, "NOT_HLT": 0.88},
+                                    "elapsed_ms": 39.1,
+                                },
+                            }
+                        },
+                    },
+                },
+                "400": {"description": "Unknown model or invalid upload"},
+                "413": {"description": "Upload is too large"},
+            },
+        }
+
+    # The endpoints running prediction jobs in the background
+    job_response = {
+        "content": {
+            "application/json": {
+                "schema": {"$ref": "#/components/schemas/JobResponse"},
+            }
+        },
+    }
+    job_id_parameter = {
+        "name": "job_id",
+        "in": "path",
+        "required": True,
+        "description": "Id of the job.",
+        "schema": {"type": "string"},
+    }
+    if "/jobs" in openapi_schema["paths"]:
+        openapi_schema["paths"]["/jobs"][method] = {
+            "description": "Start a job predicting the health of many pictures with "
+            "one model in the background. The pictures are uploaded as multipart form "
+            "files or as a zip archive. Poll the job for its progress and results.",
+            "operationId": "create_job",
+            "parameters": openapi_schema["paths"]["/predictions/batch"][method][
+                "parameters"
+            ],
+            "requestBody": openapi_schema["paths"]["/predictions/batch"][method][
+                "requestBody"
+            ],
+            "responses": {
+                "202": {"description": "The job was accepted.", **job_response},
+                "400": {"description": "Unknown model or invalid upload"},
+                "413": {"description": "Upload is too large"},
+                "503": {"description": "Too many images are waiting"},
+            },
+        }
+    if "/jobs/{job_id}" in openapi_schema["paths"]:
+        openapi_schema["paths"]["/jobs/{job_id}"] = {
+            "get": {
+                "description": "Progress and results of a job. Results are kept "
+                "for a limited time after the job has finished.",
+                "operationId": "get_job",
+                "parameters": [job_id_parameter],
+                "responses": {
+                    "200": {"description": "The job.", **job_response},
+                    "404": {"description": "Job not found or expired"},
+                },
+            },
+            "delete": {
+                "description": "Cancel a job. Results already predicted are kept.",
+                "operationId": "cancel_job",
+                "parameters": [job_id_parameter],
+                "responses": {
+                    "200": {"description": "The cancelled job.", **job_response},
+                    "404": {"description": "Job not found or expired"},
+                },
+            },
+        }
+
     # The returntypes of each endpoint
     openapi_schema["components"] = {
         "schemas": {
@@ -276,6 +478,86 @@ def custom_openapi_gen(openapi_schema: dict, example_code_dir: Path):
                     "BS_bananas": 9.579996351760656e-09,
                 },
             },
+            "ModelResult": {
+                "type": "object",
+                "properties": {
+                    "prediction": {
+                        "type": "object",
+                        "description": "Predicted class confidences of the model.",
+                    },
+                    "error": {
+                        "type": "string",
+                        "description": "Error message if the model failed.",
+                    },
+                    "status_code": {
+                        "type": "integer",
+                        "description": "Status code if the model failed.",
+                    },
+                    "elapsed_ms": {
+                        "type": "number",
+                        "description": "Time spent on the model in milliseconds.",
+                    },
+                },
+                "required": ["elapsed_ms"],
+            },
+            "JobResponse": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "string", "description": "Id of the job."},
+                    "model": {"type": "string", "description": "Model queried."},
+                    "status": {
+                        "type": "string",
+                        "enum": ["queued", "running", "completed", "cancelled"],
+                    },
+                    "progress": {
+                        "type": "object",
+                        "properties": {
+                            "completed": {"type": "integer"},
+                            "total": {"type": "integer"},
+                        },
+                    },
+                    "created_at": {
+                        "type": "number",
+                        "description": "Unix time the job was created.",
+                    },
+                    "finished_at": {
+                        "type": "number",
+                        "nullable": True,
+                        "description": "Unix time the job finished.",
+                    },
+                    "expires_at": {
+                        "type": "number",
+                        "nullable": True,
+                        "description": "Unix time the results are removed.",
+                    },
+                    "results": {
+                        "type": "object",
+                        "description": "The result for each picture predicted so "
+                        "far, keyed by file name.",
+                        "additionalProperties": {
+                            "$ref": "#/components/schemas/ModelResult"
+                        },
+                    },
+                },
+            },
+            "AllPredictionsResponse": {
+                "type": "object",
+                "properties": {
+                    "binary": {"$ref": "#/components/schemas/ModelResult"},
+                    "single-HLT": {"$ref": "#/components/schemas/ModelResult"},
+                    "multi-HLT": {"$ref": "#/components/schemas/ModelResult"},
+                },
+                "example": {
+                    "binary": {
+                        "prediction": {"HLT": 0.85, "NOT_HLT": 0.15},
+                        "elapsed_ms": 41.7,
+                    },
+                    "single-HLT": {
+                        "prediction": {"HLT": 0.84, "CSSVD": 0.15, "ANT": 0.01},
+                        "elapsed_ms": 55.2,
+                    },
+                },
+            },
         }
     }
 
@@ -285,7 +567,7 @@ def custom_openapi_gen(openapi_schema: dict, example_code_dir: Path):
     api_routes = [route.lstrip("/") for route in api_routes]
 
     for route in api_routes:
-        code_samples = get_code_samples(route, example_code_dir)
+        code_samples = get_code_samples(route, example_code_dir, api_url)
         if code_samples:
             # add leading slashes back to the routes
             route = "/" + route
@@ -297,14 +579,13 @@ def custom_openapi_gen(openapi_schema: dict, example_code_dir: Path):
     return openapi_schema
 
 
-def get_code_samples(route: str, example_code_dir: Path):
+def get_code_samples(route: str, example_code_dir: Path, api_url: str):
     code_samples = []
     normalized_route_name = route.replace("/", "__")
     for lang, file_ext in supported_languages.items():
         file_with_code_sample = (
             example_code_dir / lang.lower() / f"{normalized_route_name}.{file_ext}"
         )
-        print(file_with_code_sample)
         if os.path.isfile(file_with_code_sample):
             with open(file_with_code_sample) as f:
                 code_template = Template(f.read())
@@ -312,7 +593,7 @@ def get_code_samples(route: str, example_code_dir: Path):
                     {
                         "lang": lang,
                         "source": code_template.safe_substitute(
-                            api_url=settings.api_url,
+                            api_url=api_url,
                         ),
                     }
                 )
@@ -0,0 +1,88 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from contextvars import Context, ContextVar, copy_context
+
+from fastapi import HTTPException
+
+from crop_health_api.settings import settings
+
+
+class DeadlineExceeded(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=504, detail="Request deadline exceeded")
+
+
+class Handover:
+    # Deadline given to shared work by the last request that stopped waiting
+    # for it. It is mutable, so that the tasks the work started see it too.
+
+    def __init__(self):
+        self.expires: float | None = None
+
+
+# Time by which the prediction for the current request must be ready
+deadline: ContextVar[float | None] = ContextVar("deadline", default=None)
+handover: ContextVar[Handover | None] = ContextVar("handover", default=None)
+
+
+def start(header: str | None = None):
+    # The budget comes from the X-Request-Timeout header (in seconds) when
+    # given, and is capped so that a client cannot hold resources forever
+    timeout = settings.request_timeout
+    if header is not None:
+        try:
+            timeout = float(header)
+        except ValueError:
+            raise HTTPException(
+                status_code=400, detail="X-Request-Timeout must be a number"
+            )
+        if not 0 < timeout <= settings.request_max_timeout:
+            raise HTTPException(
+                status_code=400,
+                detail="X-Request-Timeout must be positive and at most "
+                f"{settings.request_max_timeout} seconds",
+            )
+    deadline.set(time.monotonic() + timeout)
+
+
+def shared_context() -> Context:
+    # Context for work shared by several requests, which runs without the
+    # deadline of the request that started it. Each request waiting on it
+    # enforces its own, and the work is cancelled when the last one leaves.
+    context = copy_context()
+    context.run(deadline.set, None)
+    context.run(handover.set, Handover())
+    return context
+
+
+def hand_over(context: Context):
+    # Gives shared work the deadline of the last request waiting for it before
+    # it is cancelled, so that it is seen as expired if that request was
+    context.run(handover.get).expires = deadline.get()
+
+
+def remaining() -> float | None:
+    expires = deadline.get()
+    if expires is None and handover.get() is not None:
+        expires = handover.get().expires
+    if expires is None:
+        return None
+    return expires - time.monotonic()
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+@asynccontextmanager
+async def enforce():
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded()
+    try:
+        async with asyncio.timeout(left):
+            yield
+    except TimeoutError:
+        raise DeadlineExceeded()
@@ -0,0 +1,85 @@
+import gzip
+import hashlib
+import json
+from dataclasses import dataclass
+
+import brotli
+from fastapi import Request, Response
+
+# Preferred first when the client accepts several encodings
+ENCODINGS = ("br", "gzip")
+
+
+@dataclass(frozen=True)
+class EncodedDocument:
+    # A JSON document serialized and compressed once, served as is on every
+    # request with a strong ETag per encoding
+
+    bodies: dict[str, bytes]
+    etags: dict[str, str]
+
+    @classmethod
+    def from_json(cls, document: dict) -> "EncodedDocument":
+        # Same serialization as FastAPI's JSONResponse
+        identity = json.dumps(
+            document,
+            ensure_ascii=False,
+            allow_nan=False,
+            indent=None,
+            separators=(",", ":"),
+        ).encode("utf-8")
+        bodies = {
+            "identity": identity,
+            "gzip": gzip.compress(identity, compresslevel=9, mtime=0),
+            "br": brotli.compress(identity, quality=11),
+        }
+        digest = hashlib.sha256(identity).hexdigest()[:32]
+        etags = {
+            encoding: (
+                f'"{digest}"' if encoding == "identity" else f'"{digest}-{encoding}"'
+            )
+            for encoding in bodies
+        }
+        return cls(bodies, etags)
+
+    def response(self, request: Request) -> Response:
+        encoding = negotiate_encoding(request.headers.get("accept-encoding", ""))
+        headers = {"ETag": self.etags[encoding], "Vary": "Accept-Encoding"}
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+
+        if_none_match = request.headers.get("if-none-match", "")
+        requested = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        # Only a validator of the selected representation matches
+        if "*" in requested or self.etags[encoding] in requested:
+            headers.pop("Content-Encoding", None)
+            return Response(status_code=304, headers=headers)
+
+        return Response(
+            self.bodies[encoding], media_type="application/json", headers=headers
+        )
+
+
+def negotiate_encoding(accept_encoding: str) -> str:
+    accepted = set()
+    # Refused explicitly, so not accepted through a wildcard
+    refused = set()
+    for item in accept_encoding.split(","):
+        name, _, parameters = item.strip().partition(";")
+        quality = 1.0
+        parameters = parameters.strip()
+        if parameters.startswith("q="):
+            try:
+                quality = float(parameters[2:])
+            except ValueError:
+                quality = 0.0
+        if quality > 0:
+            accepted.add(name.strip().lower())
+        else:
+            refused.add(name.strip().lower())
+    for encoding in ENCODINGS:
+        if encoding in refused:
+            continue
+        if encoding in accepted or "*" in accepted:
+            return encoding
+    return "identity"
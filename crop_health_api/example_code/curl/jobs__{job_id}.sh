@@ -0,0 +1 @@
+curl -X GET $api_url/jobs/$job_id
\ No newline at end of file
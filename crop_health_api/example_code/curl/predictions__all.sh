@@ -0,0 +1 @@
+curl -X POST "$api_url/predictions/all?models=binary,single-HLT" -T cocoa.jpg
\ No newline at end of file
@@ -0,0 +1 @@
+curl -X POST "$api_url/predictions/batch?model=binary" -F "files=@cocoa.jpg" -F "files=@maize.jpg"
\ No newline at end of file
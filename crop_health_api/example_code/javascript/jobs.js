@@ -0,0 +1,18 @@
+const form = new FormData();
+form.append("files", new Blob([fs.readFileSync('cocoa.jpg')]), "cocoa.jpg");
+form.append("files", new Blob([fs.readFileSync('maize.jpg')]), "maize.jpg");
+
+// Start a job getting the binary model predictions for images
+// cocoa.jpg and maize.jpg in the background
+fetch.then(async fetch => {
+    const response_job = await fetch(
+        "$api_url/jobs?model=binary",
+        {
+            method: "POST",
+            body: form,
+        }
+    );
+    const job = await response_job.json();
+    // Print the id of the job to poll for its results
+    console.log(job.id);
+});
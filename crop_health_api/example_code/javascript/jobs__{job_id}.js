@@ -0,0 +1,13 @@
+// Poll the job until it has finished
+fetch.then(async fetch => {
+    let job;
+    do {
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        const response_job = await fetch("$api_url/jobs/" + job_id);
+        job = await response_job.json();
+    } while (job.status === "queued" || job.status === "running");
+    // Print the prediction for the healthy class of each image
+    for (const [file_name, result] of Object.entries(job.results)) {
+        console.log(file_name, result.prediction.HLT);
+    }
+});
@@ -0,0 +1,16 @@
+const imageData = fs.readFileSync('cocoa.jpg');
+
+// Get the predictions of the binary and single-HLT models for image
+// cocoa.jpg, uploading the image only once
+fetch.then(async fetch => {
+    const response_all = await fetch(
+        "$api_url/predictions/all?models=binary,single-HLT",
+        {
+            method: "POST",
+            body: imageData,
+        }
+    );
+    const data_all = await response_all.json();
+    // Print the prediction of the binary model for the healthy class
+    console.log(data_all.binary.prediction.HLT);
+});
@@ -0,0 +1,19 @@
+const form = new FormData();
+form.append("files", new Blob([fs.readFileSync('cocoa.jpg')]), "cocoa.jpg");
+form.append("files", new Blob([fs.readFileSync('maize.jpg')]), "maize.jpg");
+
+// Get the binary model predictions for images cocoa.jpg and maize.jpg
+// uploaded together as multipart form files
+fetch.then(async fetch => {
+    const response_batch = await fetch(
+        "$api_url/predictions/batch?model=binary",
+        {
+            method: "POST",
+            body: form,
+        }
+    );
+    const data_batch = await response_batch.json();
+    // Print the prediction for the healthy class of each image
+    console.log(data_batch["cocoa.jpg"].prediction.HLT);
+    console.log(data_batch["maize.jpg"].prediction.HLT);
+});
@@ -0,0 +1,15 @@
+from httpx import Client
+
+with Client() as client:
+    # Start a job getting the binary model predictions for images
+    # cocoa.jpg and maize.jpg in the background
+    with open("cocoa.jpg", "rb") as cocoa, open("maize.jpg", "rb") as maize:
+        response_job = client.post(
+            url="$api_url" + "/jobs",
+            params={"model": "binary"},
+            files=[("files", cocoa), ("files", maize)],
+        )
+
+    job = response_job.json()
+    # Print the id of the job to poll for its results
+    print(job["id"])
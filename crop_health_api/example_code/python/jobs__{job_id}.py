@@ -0,0 +1,15 @@
+import time
+
+from httpx import Client
+
+with Client() as client:
+    # Poll the job until it has finished
+    while True:
+        job = client.get(url="$api_url" + f"/jobs/{job_id}").json()
+        if job["status"] not in ("queued", "running"):
+            break
+        time.sleep(1)
+
+    # Print the prediction for the healthy class of each image
+    for file_name, result in job["results"].items():
+        print(file_name, result["prediction"]["HLT"])
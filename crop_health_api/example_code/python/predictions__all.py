@@ -0,0 +1,18 @@
+from httpx import Client
+
+# Open the image file as a binary file
+with open("cocoa.jpg", "rb") as image_file:
+    image_bytes = image_file.read()
+
+with Client() as client:
+    # Get the predictions of the binary and single-HLT models for
+    # image cocoa.jpg, uploading the image only once
+    response_all = client.post(
+        url="$api_url" + "/predictions/all",
+        params={"models": "binary,single-HLT"},
+        content=image_bytes,
+    )
+
+    data_all = response_all.json()
+    # Print the prediction of the binary model for the healthy class
+    print(data_all["binary"]["prediction"]["HLT"])
@@ -0,0 +1,16 @@
+from httpx import Client
+
+with Client() as client:
+    # Get the binary model predictions for images cocoa.jpg and maize.jpg
+    # uploaded together as multipart form files
+    with open("cocoa.jpg", "rb") as cocoa, open("maize.jpg", "rb") as maize:
+        response_batch = client.post(
+            url="$api_url" + "/predictions/batch",
+            params={"model": "binary"},
+            files=[("files", cocoa), ("files", maize)],
+        )
+
+    data_batch = response_batch.json()
+    # Print the prediction for the healthy class of each image
+    for file_name, result in data_batch.items():
+        print(file_name, result["prediction"]["HLT"])
@@ -0,0 +1,149 @@
+import logging
+import time
+
+import grpc
+from grpc import aio
+from httpx import Response
+
+from crop_health_api.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Method of TorchServe's InferenceAPIsService, see TorchServe's inference.proto
+PREDICTIONS_METHOD = (
+    "/org.pytorch.serve.grpc.inference.InferenceAPIsService/Predictions"
+)
+
+STATUS_CODES = {
+    grpc.StatusCode.INVALID_ARGUMENT: 400,
+    grpc.StatusCode.NOT_FOUND: 404,
+    grpc.StatusCode.RESOURCE_EXHAUSTED: 503,
+    grpc.StatusCode.UNAVAILABLE: 503,
+    grpc.StatusCode.DEADLINE_EXCEEDED: 504,
+}
+
+
+class TransportUnavailable(Exception):
+    pass
+
+
+def _varint(value: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            encoded.append(byte | 0x80)
+        else:
+            encoded.append(byte)
+            return bytes(encoded)
+
+
+def _field(number: int, value: bytes) -> bytes:
+    # Length-delimited protobuf field
+    return _varint(number << 3 | 2) + _varint(len(value)) + value
+
+
+def encode_predictions_request(
+    model_name: str, data: bytes, model_version: str = ""
+) -> bytes:
+    # PredictionsRequest {
+    #   string model_name = 1; string model_version = 2; map<string, bytes> input = 3;
+    # }
+    message = _field(1, model_name.encode())
+    if model_version:
+        message += _field(2, model_version.encode())
+    entry = _field(1, b"data") + _field(2, data)
+    return message + _field(3, entry)
+
+
+def decode_prediction_response(message: bytes) -> bytes:
+    # PredictionResponse { bytes prediction = 1; }
+    position = 0
+    while position < len(message):
+        key, position = _read_varint(message, position)
+        number, wire_type = key >> 3, key & 0x07
+        if wire_type == 2:
+            length, position = _read_varint(message, position)
+            value = message[position : position + length]
+            position += length
+            if number == 1:
+                return value
+        elif wire_type == 0:
+            _, position = _read_varint(message, position)
+        elif wire_type == 1:
+            position += 8
+        elif wire_type == 5:
+            position += 4
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+    return b""
+
+
+def _read_varint(message: bytes, position: int) -> tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        byte = message[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
+
+
+class GrpcClient:
+    # Persistent channel to the gRPC inference address of a TorchServe backend
+
+    def __init__(self, target: str):
+        self.channel = aio.insecure_channel(
+            target,
+            options=[
+                ("grpc.max_send_message_length", settings.max_request_body_size + 1024),
+                (
+                    "grpc.keepalive_time_ms",
+                    int(settings.torchserve_keepalive_expiry * 1000),
+                ),
+            ],
+        )
+        # Until then predictions go over HTTP, as the channel could not connect
+        self.unavailable_until = 0.0
+        self._predictions = self.channel.unary_unary(
+            PREDICTIONS_METHOD,
+            request_serializer=lambda message: message,
+            response_deserializer=decode_prediction_response,
+        )
+
+    @property
+    def available(self) -> bool:
+        return time.monotonic() >= self.unavailable_until
+
+    async def close(self):
+        await self.channel.close()
+
+    async def predict(
+        self, model: str, data: bytes, model_version: str = ""
+    ) -> Response:
+        # Raw bytes in a protobuf message instead of a multipart upload. The
+        # answer is wrapped in an httpx response so callers handle both
+        # transports alike.
+        try:
+            prediction = await self._predictions(
+                encode_predictions_request(model, data, model_version),
+                timeout=settings.torchserve_read_timeout,
+            )
+        except aio.AioRpcError as e:
+            # UNAVAILABLE is also how TorchServe reports being busy, which only
+            # another transport would not help with
+            if (
+                e.code() == grpc.StatusCode.UNAVAILABLE
+                and self.channel.get_state() != grpc.ChannelConnectivity.READY
+            ):
+                self.unavailable_until = (
+                    time.monotonic() + settings.torchserve_grpc_retry_interval
+                )
+                raise TransportUnavailable(e.details())
+            return Response(STATUS_CODES.get(e.code(), 500), text=e.details() or "")
+        return Response(
+            200, content=prediction, headers={"content-type": "application/json"}
+        )
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+from httpx import AsyncClient
+
+from crop_health_api.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class HealthStatus:
+    healthy: bool = False
+    body: dict | None = None
+    detail: str = "TorchServe has not been checked yet"
+    checked_at: float | None = None
+
+    @property
+    def age(self) -> float | None:
+        if self.checked_at is None:
+            return None
+        return time.time() - self.checked_at
+
+
+class HealthMonitor:
+    # Polls a TorchServe /ping endpoint in the background and keeps the last
+    # result, so that health probes never wait on TorchServe themselves
+
+    def __init__(self, ping_url: Callable[[], str], client: Callable[[], AsyncClient]):
+        self.ping_url = ping_url
+        self.client = client
+        self.status = HealthStatus()
+        self._task: asyncio.Task | None = None
+
+    async def check(self) -> HealthStatus:
+        try:
+            response = await self.client().get(
+                self.ping_url(), timeout=settings.health_check_timeout
+            )
+            if response.status_code == 200:
+                status = HealthStatus(True, response.json(), "", time.time())
+            else:
+                status = HealthStatus(
+                    False,
+                    None,
+                    f"TorchServe is not ready. Status code: {response.status_code}",
+                    time.time(),
+                )
+        except Exception as e:
+            status = HealthStatus(False, None, str(e) or repr(e), time.time())
+        if status.healthy != self.status.healthy:
+            logger.info("Health of %s changed to %s", self.ping_url(), status.healthy)
+        self.status = status
+        return status
+
+    @property
+    def healthy(self) -> bool:
+        # A result older than the allowed age means the poller is stuck
+        age = self.status.age
+        return (
+            self.status.healthy and age is not None and age <= settings.health_max_age
+        )
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(settings.health_check_interval)
+            await self.check()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+
+from crop_health_api.predictions import predict_result
+from crop_health_api.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+@dataclass
+class Job:
+    id: str
+    model: str
+    # Images still to be predicted, set to None once done to free the memory
+    images: list[tuple[str, bytes] | None]
+    status: str = "queued"
+    results: dict = field(default_factory=dict)
+    created_at: float = field(default_factory=time.time)
+    finished_at: float | None = None
+
+    @property
+    def total(self) -> int:
+        return len(self.images)
+
+    @property
+    def expires_at(self) -> float | None:
+        if self.finished_at is None:
+            return None
+        return self.finished_at + settings.jobs_result_ttl
+
+    def finish(self, status: str):
+        self.status = status
+        self.finished_at = time.time()
+        self.images = [None] * len(self.images)
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "model": self.model,
+            "status": self.status,
+            "progress": {"completed": len(self.results), "total": self.total},
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "expires_at": self.expires_at,
+            "results": self.results,
+        }
+
+
+class RateLimiter:
+    # Spaces out calls to at most `rate` per second, unlimited when rate is 0
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0.0
+        self.next_at = 0.0
+
+    async def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        delay = self.next_at - now
+        self.next_at = max(now, self.next_at) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class JobManager:
+    # Runs prediction jobs in the background with a pool of workers draining a
+    # shared queue of images, at a controlled rate
+
+    def __init__(self):
+        self.jobs: dict[str, Job] = {}
+        self.queue: asyncio.Queue[tuple[Job, int]] | None = None
+        self.limiter = RateLimiter(settings.jobs_max_rate)
+        self.workers: list[asyncio.Task] = []
+        # Size of the images held by queued jobs
+        self.queued_bytes = 0
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.workers = [
+            asyncio.create_task(self._work()) for _ in range(settings.jobs_workers)
+        ]
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    def create(self, model: str, images: list[tuple[str, bytes]]) -> Job:
+        self.purge_expired()
+        if self.queue.qsize() + len(images) > settings.jobs_max_queued_images:
+            raise JobQueueFull("Too many images are waiting, try again later")
+        size = sum(len(body) for _, body in images)
+        if self.queued_bytes + size > settings.jobs_max_queued_bytes:
+            raise JobQueueFull("Too many images are waiting, try again later")
+        self.queued_bytes += size
+        job = Job(uuid.uuid4().hex, model, list(images))
+        self.jobs[job.id] = job
+        for index in range(job.total):
+            self.queue.put_nowait((job, index))
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        self.purge_expired()
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Job | None:
+        job = self.get(job_id)
+        if job is not None and job.status in ("queued", "running"):
+            # Images of the job still in the queue are skipped by the workers
+            for index in range(job.total):
+                self._release(job, index)
+            job.finish("cancelled")
+        return job
+
+    def purge_expired(self):
+        now = time.time()
+        expired = [
+            job_id
+            for job_id, job in self.jobs.items()
+            if job.expires_at is not None and job.expires_at <= now
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def _release(self, job: Job, index: int):
+        # Frees an image once predicted, failed or cancelled
+        image = job.images[index]
+        if image is not None:
+            self.queued_bytes -= len(image[1])
+            job.images[index] = None
+
+    async def _work(self):
+        while True:
+            job, index = await self.queue.get()
+            try:
+                await self._predict(job, index)
+            except Exception:
+                logger.exception("Job %s failed on image %s", job.id, index)
+            finally:
+                self._release(job, index)
+                self.queue.task_done()
+
+    async def _predict(self, job: Job, index: int):
+        if job.images[index] is None:
+            return
+        await self.limiter.wait()
+        # The job may have been cancelled while waiting
+        image = job.images[index]
+        if image is None:
+            return
+        job.status = "running"
+        name, body = image
+        result = await predict_result(body, job.model)
+        if job.status == "cancelled":
+            return
+        job.results[name] = result
+        self._release(job, index)
+        if len(job.results) == job.total:
+            job.finish("completed")
+
+
+manager = JobManager()
@@ -0,0 +1,246 @@
+import time
+from contextvars import ContextVar
+
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import REGISTRY
+from starlette.routing import Match
+
+SIZE_BUCKETS = (
+    1024,
+    10 * 1024,
+    100 * 1024,
+    512 * 1024,
+    1024 * 1024,
+    2 * 1024 * 1024,
+    5 * 1024 * 1024,
+    10 * 1024 * 1024,
+    20 * 1024 * 1024,
+)
+
+REQUEST_DURATION = Histogram(
+    "crop_health_request_duration_seconds",
+    "Time spent handling a request in the gateway, including TorchServe.",
+    ["route"],
+)
+GATEWAY_OVERHEAD = Histogram(
+    "crop_health_gateway_overhead_seconds",
+    "Time spent handling a request in the gateway, excluding TorchServe.",
+    ["route"],
+)
+UPSTREAM_DURATION = Histogram(
+    "crop_health_upstream_duration_seconds",
+    "Time spent waiting on TorchServe for a prediction.",
+    ["model"],
+)
+UPSTREAM_ERRORS = Counter(
+    "crop_health_upstream_errors",
+    "Predictions that TorchServe failed or did not answer.",
+    ["model", "status"],
+)
+UPSTREAM_RETRIES = Counter(
+    "crop_health_upstream_retries",
+    "Extra requests sent to TorchServe, as retries or hedges.",
+    ["kind"],
+)
+REQUEST_SIZE = Histogram(
+    "crop_health_request_size_bytes",
+    "Size of request bodies.",
+    ["route"],
+    buckets=SIZE_BUCKETS,
+)
+RESPONSE_SIZE = Histogram(
+    "crop_health_response_size_bytes",
+    "Size of response bodies.",
+    ["route"],
+    buckets=SIZE_BUCKETS,
+)
+IN_FLIGHT = Gauge(
+    "crop_health_requests_in_flight",
+    "Requests currently being handled.",
+    ["route"],
+)
+
+ADMISSION_ACTIVE = Gauge(
+    "crop_health_admission_active",
+    "Requests to TorchServe currently admitted.",
+    ["model"],
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "crop_health_admission_queue_depth",
+    "Requests waiting to be admitted to TorchServe.",
+    ["model"],
+)
+ADMISSION_REJECTED = Counter(
+    "crop_health_admission_rejected",
+    "Requests rejected because TorchServe was overloaded.",
+    ["model", "reason"],
+)
+CIRCUIT_STATE = Gauge(
+    "crop_health_circuit_state",
+    "State of the circuit breaker of a model: 0 closed, 1 half-open, 2 open.",
+    ["model"],
+)
+CIRCUIT_REJECTED = Counter(
+    "crop_health_circuit_rejected",
+    "Requests rejected at once because the circuit of the model was open.",
+    ["model"],
+)
+AUTOSCALE_WORKERS = Gauge(
+    "crop_health_autoscale_workers",
+    "TorchServe workers of a model set by the autoscaler.",
+    ["model"],
+)
+NEAR_DUPLICATE_HITS = Counter(
+    "crop_health_near_duplicate_hits",
+    "Predictions answered from the cache for a near-duplicate image.",
+    ["model"],
+)
+COALESCED_REQUESTS = Counter(
+    "crop_health_coalesced_requests",
+    "Requests that shared the TorchServe call of an identical request.",
+    ["model"],
+)
+BACKEND_OUTSTANDING = Gauge(
+    "crop_health_backend_outstanding",
+    "Requests currently sent to a TorchServe backend.",
+    ["backend"],
+)
+BACKEND_AVAILABLE = Gauge(
+    "crop_health_backend_available",
+    "Whether a TorchServe backend receives requests.",
+    ["backend"],
+)
+
+
+class UpstreamTime:
+    # Wall-clock time a request spends waiting on TorchServe. Concurrent
+    # predictions of the same request are counted once.
+
+    def __init__(self):
+        self.total = 0.0
+        self.active = 0
+        self.since = 0.0
+
+    def start(self):
+        if self.active == 0:
+            self.since = time.perf_counter()
+        self.active += 1
+
+    def stop(self):
+        self.active -= 1
+        if self.active == 0:
+            self.total += time.perf_counter() - self.since
+
+
+upstream_time: ContextVar[UpstreamTime | None] = ContextVar(
+    "upstream_time", default=None
+)
+
+
+def upstream_started():
+    spent = upstream_time.get()
+    if spent is not None:
+        spent.start()
+
+
+def upstream_finished(
+    model: str, elapsed: float, status: int | None, observed: bool = True
+):
+    # Calls that are not observed, like a lost hedge, are neither errors nor
+    # latencies of TorchServe
+    if observed:
+        UPSTREAM_DURATION.labels(model).observe(elapsed)
+        if status != 200:
+            UPSTREAM_ERRORS.labels(model, str(status or "error")).inc()
+    upstream_stopped()
+
+
+def upstream_stopped():
+    spent = upstream_time.get()
+    if spent is not None:
+        spent.stop()
+
+
+class CacheCollector:
+    # Exposes the counters the prediction cache keeps itself
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def collect(self):
+        stats = self.cache.stats()
+        for name in ("hits", "misses", "evictions", "expirations"):
+            yield CounterMetricFamily(
+                f"crop_health_prediction_cache_{name}",
+                f"Prediction cache {name}.",
+                value=stats[name],
+            )
+        yield GaugeMetricFamily(
+            "crop_health_prediction_cache_entries",
+            "Predictions in the cache.",
+            value=stats["entries"],
+        )
+        yield GaugeMetricFamily(
+            "crop_health_prediction_cache_size_bytes",
+            "Size of the predictions in the cache.",
+            value=stats["size"],
+        )
+
+
+def register_cache(cache):
+    REGISTRY.register(CacheCollector(cache))
+
+
+class MetricsMiddleware:
+    # Plain ASGI middleware so that body sizes can be counted while they are
+    # streamed, without buffering them
+
+    def __init__(self, app):
+        self.app = app
+
+    def route_label(self, scope) -> str:
+        # Requests are labelled with the template of the route they match, the
+        # way the router matches them, so that /jobs/{job_id} is one series.
+        # Unknown paths share a label to keep the number of series bounded.
+        for route in scope["app"].routes:
+            match, _ = route.matches(scope)
+            if match != Match.NONE:
+                return route.path
+        return "other"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        route = self.route_label(scope)
+        request_size = 0
+        response_size = 0
+
+        async def counting_receive():
+            nonlocal request_size
+            message = await receive()
+            if message["type"] == "http.request":
+                request_size += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal response_size
+            if message["type"] == "http.response.body":
+                response_size += len(message.get("body", b""))
+            await send(message)
+
+        spent = UpstreamTime()
+        token = upstream_time.set(spent)
+        start = time.perf_counter()
+        IN_FLIGHT.labels(route).inc()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            elapsed = time.perf_counter() - start
+            IN_FLIGHT.labels(route).dec()
+            upstream_time.reset(token)
+            REQUEST_DURATION.labels(route).observe(elapsed)
+            GATEWAY_OVERHEAD.labels(route).observe(max(elapsed - spent.total, 0.0))
+            REQUEST_SIZE.labels(route).observe(request_size)
+            RESPONSE_SIZE.labels(route).observe(response_size)
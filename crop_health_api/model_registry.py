@@ -0,0 +1,175 @@
+import asyncio
+import logging
+
+from crop_health_api import torchserve
+from crop_health_api.backends import Backend
+from crop_health_api.settings import ModelConfig, settings
+
+logger = logging.getLogger(__name__)
+
+
+class ModelReconciler:
+    # Keeps the models served by TorchServe configured as in the
+    # torchserve_models setting. Batching and the response timeout can only be
+    # set when registering a model, so a model with other values is
+    # registered again, with its backend out of rotation. After startup, this
+    # waits until another backend can serve the model. Worker counts are left
+    # to the autoscaler when enabled.
+
+    def __init__(self):
+        self._task: asyncio.Task | None = None
+
+    async def reconcile_model(
+        self, backend: Backend, model: str, config: ModelConfig, startup: bool
+    ):
+        client = torchserve.get_client()
+        response = await client.get(backend.management_url(f"/models/{model}"))
+        response.raise_for_status()
+        current = response.json()[0]
+        min_workers = current["minWorkers"]
+        max_workers = current["maxWorkers"]
+        if not settings.autoscale_enabled:
+            min_workers = config.min_workers or min_workers
+            max_workers = config.max_workers or max(max_workers, min_workers)
+        previous = ModelConfig(
+            batch_size=current["batchSize"],
+            max_batch_delay=current["maxBatchDelay"],
+            response_timeout=current.get("responseTimeout", config.response_timeout),
+        )
+        if (
+            previous.batch_size,
+            previous.max_batch_delay,
+            previous.response_timeout,
+        ) != (config.batch_size, config.max_batch_delay, config.response_timeout):
+            # The model is unavailable on the backend while it is registered
+            # again, so other backends must serve it. At startup predictions
+            # are answered with a 503 meanwhile when there is no other.
+            others = [
+                other
+                for other in torchserve.pool.backends
+                if other is not backend and other.available
+            ]
+            if not others and not startup:
+                logger.warning(
+                    "Not registering model %s on %s again, it is the only "
+                    "available backend",
+                    model,
+                    backend.address,
+                )
+                return
+            await self.register_again(
+                backend, model, current["modelUrl"], config, previous, min_workers
+            )
+            if max_workers == min_workers:
+                return
+        elif (min_workers, max_workers) == (
+            current["minWorkers"],
+            current["maxWorkers"],
+        ):
+            return
+        logger.warning(
+            "Scaling model %s on %s to %s-%s workers",
+            model,
+            backend.address,
+            min_workers,
+            max_workers,
+        )
+        response = await client.put(
+            backend.management_url(f"/models/{model}"),
+            params={"min_worker": min_workers, "max_worker": max_workers},
+        )
+        response.raise_for_status()
+
+    async def register_again(
+        self,
+        backend: Backend,
+        model: str,
+        url: str,
+        config: ModelConfig,
+        previous: ModelConfig,
+        workers: int,
+    ):
+        logger.warning(
+            "Registering model %s on %s again with %s", model, backend.address, config
+        )
+        backend.draining = True
+        try:
+            # Let the requests already sent to the backend finish
+            waited = 0.0
+            while backend.outstanding and waited < settings.torchserve_read_timeout:
+                await asyncio.sleep(0.1)
+                waited += 0.1
+            response = await torchserve.get_client().delete(
+                backend.management_url(f"/models/{model}")
+            )
+            response.raise_for_status()
+            try:
+                await self.register(backend, model, url, config, workers)
+            except Exception:
+                logger.warning(
+                    "Could not register model %s on %s, restoring %s",
+                    model,
+                    backend.address,
+                    previous,
+                )
+                await self.register(backend, model, url, previous, workers)
+                raise
+        finally:
+            backend.draining = False
+
+    async def register(
+        self, backend: Backend, model: str, url: str, config: ModelConfig, workers: int
+    ):
+        response = await torchserve.get_client().post(
+            backend.management_url("/models"),
+            params={
+                "url": url,
+                "model_name": model,
+                "batch_size": config.batch_size,
+                "max_batch_delay": config.max_batch_delay,
+                "response_timeout": config.response_timeout,
+                "initial_workers": workers,
+                "synchronous": "true",
+            },
+        )
+        response.raise_for_status()
+
+    async def reconcile(self, startup: bool = False):
+        # One backend at a time, so that the others keep serving while a model
+        # is registered again
+        for backend in torchserve.pool.backends:
+            for model, config in settings.torchserve_models.items():
+                try:
+                    await self.reconcile_model(backend, model, config, startup)
+                except Exception as e:
+                    logger.warning(
+                        "Could not configure model %s on %s: %r",
+                        model,
+                        backend.address,
+                        e,
+                    )
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.model_reconcile_interval)
+            await self.reconcile()
+
+    def start(self):
+        if (
+            settings.torchserve_models
+            and settings.model_reconcile_interval > 0
+            and self._task is None
+        ):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+reconciler = ModelReconciler()
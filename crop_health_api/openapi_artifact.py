@@ -0,0 +1,133 @@
+import argparse
+import json
+import pathlib
+
+from crop_health_api.custom_openapi import custom_openapi_gen
+from crop_health_api.settings import settings
+
+example_code_dir = pathlib.Path(__file__).parent / "example_code"
+
+# Placeholders for the values only known when the app starts, filled in when
+# the artifact is loaded
+API_URL_PLACEHOLDER = "$api_url"
+VERSION_PLACEHOLDER = "$version"
+
+# Endpoints of TorchServe's OpenAPI description that we keep
+endpoints_to_keep = ["/ping"]
+
+# Custom endpoints we want to show in the openapi docs, with their methods
+custom_endpoints = {
+    "/predictions/binary": ["post"],
+    "/predictions/single-HLT": ["post"],
+    "/predictions/multi-HLT": ["post"],
+    "/predictions/all": ["post"],
+    "/predictions/batch": ["post"],
+    "/jobs": ["post"],
+    "/jobs/{job_id}": ["get", "delete"],
+}
+
+# The parts of TorchServe's OpenAPI description that we keep, so that the
+# document can be built without TorchServe running
+TORCHSERVE_OPENAPI = {
+    "openapi": "3.0.1",
+    "info": {"title": "TorchServe APIs", "version": "0.11.0"},
+    "paths": {
+        "/ping": {
+            "get": {
+                "description": "Get TorchServe status.",
+                "operationId": "ping",
+                "parameters": [],
+                "responses": {
+                    "200": {
+                        "description": "TorchServe status",
+                        "content": {
+                            "application/json": {
+                                "schema": {
+                                    "type": "object",
+                                    "required": ["status"],
+                                    "properties": {
+                                        "status": {
+                                            "type": "string",
+                                            "description": "Overall status of the TorchServe.",
+                                        }
+                                    },
+                                }
+                            }
+                        },
+                    },
+                    "500": {
+                        "description": "Internal Server Error",
+                        "content": {
+                            "application/json": {
+                                "schema": {
+                                    "type": "object",
+                                    "required": ["code", "type", "message"],
+                                    "properties": {
+                                        "code": {
+                                            "type": "integer",
+                                            "description": "Error code.",
+                                        },
+                                        "type": {
+                                            "type": "string",
+                                            "description": "Error type.",
+                                        },
+                                        "message": {
+                                            "type": "string",
+                                            "description": "Error message.",
+                                        },
+                                    },
+                                }
+                            }
+                        },
+                    },
+                },
+            }
+        }
+    },
+}
+
+
+def build_openapi(
+    torchserve_openapi: dict, api_url: str | None = None, version: str | None = None
+) -> dict:
+    openapi_json = json.loads(json.dumps(torchserve_openapi))
+    # Remove specific endpoints if needed
+    for endpoint in list(openapi_json["paths"].keys()):
+        if endpoint not in endpoints_to_keep:
+            del openapi_json["paths"][endpoint]
+
+    for endpoint, methods in custom_endpoints.items():
+        openapi_json["paths"][endpoint] = {
+            method: {"responses": {}} for method in methods
+        }
+
+    return custom_openapi_gen(openapi_json, example_code_dir, api_url, version)
+
+
+def write_artifact(path: pathlib.Path):
+    openapi_json = build_openapi(
+        TORCHSERVE_OPENAPI, API_URL_PLACEHOLDER, VERSION_PLACEHOLDER
+    )
+    path.write_text(json.dumps(openapi_json, ensure_ascii=False))
+
+
+def load_artifact(path: pathlib.Path) -> dict | None:
+    if not path.is_file():
+        return None
+    text = path.read_text()
+    # Plain replacements rather than a Template, the code samples contain "$"
+    text = text.replace(API_URL_PLACEHOLDER, settings.api_url)
+    text = text.replace(VERSION_PLACEHOLDER, settings.version)
+    return json.loads(text)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate the OpenAPI document and code samples ahead of time"
+    )
+    parser.add_argument(
+        "--output", type=pathlib.Path, default=pathlib.Path(settings.openapi_artifact)
+    )
+    arguments = parser.parse_args()
+    write_artifact(arguments.output)
+    print(f"Wrote {arguments.output}")
@@ -0,0 +1,146 @@
+import hashlib
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+
+@dataclass
+class CacheEntry:
+    value: Any
+    size: int
+    expires_at: float
+
+
+class PredictionCache:
+    # In-process LRU cache of predictions, bounded by the total size of the
+    # cached responses and with a time to live for each entry
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+
+    @staticmethod
+    def key(body: bytes, model: str, model_version: str) -> str:
+        return f"{hashlib.sha256(body).hexdigest()}:{model}:{model_version}"
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def peek(self, key: str) -> Any | None:
+        # Like get, but for lookups that are not requests of their own, so
+        # the hit and miss counters are left alone
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at <= time.monotonic():
+            return None
+        self._entries.move_to_end(key)
+        return entry.value
+
+    def put(self, key: str, value: Any, size: int):
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = CacheEntry(value, size, time.monotonic() + self.ttl)
+        self.size += size
+        while self.size > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self.size -= entry.size
+
+
+class NearDuplicateIndex:
+    # Perceptual hashes of recently predicted images, pointing to the cache key
+    # of their prediction. Hashes are only compared with those of the same
+    # model and version. Each 64 bit hash is split in BANDS bands, and two
+    # hashes closer than BANDS bits apart have at least one band in common, so
+    # only hashes sharing a band are compared.
+
+    BANDS = 8
+    BAND_BITS = 64 // BANDS
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._bands: dict[tuple[str, int, int], set[str]] = {}
+
+    @staticmethod
+    def scope(key: str) -> str:
+        # Model and version part of a prediction cache key
+        return key.partition(":")[2]
+
+    def _band_keys(self, image_hash: int, scope: str):
+        mask = (1 << self.BAND_BITS) - 1
+        for band in range(self.BANDS):
+            yield scope, band, image_hash >> (band * self.BAND_BITS) & mask
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, image_hash: int, key: str):
+        if key in self._entries:
+            self.remove(key)
+        self._entries[key] = image_hash
+        for band_key in self._band_keys(image_hash, self.scope(key)):
+            self._bands.setdefault(band_key, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self.remove(next(iter(self._entries)))
+
+    def find(self, image_hash: int, scope: str, max_distance: int) -> str | None:
+        # Key of the closest hash at most max_distance bits away, which must be
+        # below BANDS
+        best, best_distance = None, max_distance + 1
+        for band_key in self._band_keys(image_hash, scope):
+            for key in self._bands.get(band_key, ()):
+                distance = (self._entries[key] ^ image_hash).bit_count()
+                if distance < best_distance:
+                    best, best_distance = key, distance
+        return best
+
+    def remove(self, key: str):
+        image_hash = self._entries.pop(key, None)
+        if image_hash is None:
+            return
+        for band_key in self._band_keys(image_hash, self.scope(key)):
+            band = self._bands[band_key]
+            band.discard(key)
+            if not band:
+                del self._bands[band_key]
@@ -0,0 +1,220 @@
+import asyncio
+import time
+from typing import AsyncIterator, Awaitable, Callable, NamedTuple
+
+import orjson
+from fastapi import HTTPException
+
+from crop_health_api import deadline, metrics, preprocessing, torchserve
+from crop_health_api.prediction_cache import NearDuplicateIndex, PredictionCache
+from crop_health_api.settings import settings
+
+
+class Prediction(NamedTuple):
+    # The response of TorchServe as is, it is passed through without decoding
+    content: bytes
+    media_type: str
+
+
+cache = PredictionCache(
+    settings.prediction_cache_max_bytes, settings.prediction_cache_ttl
+)
+metrics.register_cache(cache)
+# Perceptual hashes of the cached predictions, to answer re-encoded copies of
+# an image from the cache too
+near_duplicates = NearDuplicateIndex(settings.near_duplicate_max_entries)
+
+
+class SharedCall:
+    # An upstream call shared by identical requests. It runs without a deadline
+    # of its own and is cancelled once no request waits for it any more, so it
+    # never outlives the latest deadline of its callers.
+
+    def __init__(self, key: str, call: Awaitable[Prediction]):
+        self.key = key
+        self.context = deadline.shared_context()
+        # Each caller counts its own wait as time spent on TorchServe
+        self.context.run(metrics.upstream_time.set, None)
+        self.task = asyncio.create_task(call, context=self.context)
+        self.task.add_done_callback(self._done)
+        self.waiters = 0
+
+    async def wait(self) -> Prediction:
+        self.waiters += 1
+        metrics.upstream_started()
+        try:
+            # A cancelled caller must not cancel the call the others wait on
+            async with deadline.enforce():
+                return await asyncio.shield(self.task)
+        finally:
+            metrics.upstream_stopped()
+            self.waiters -= 1
+            if self.waiters == 0 and not self.task.done():
+                # Later identical requests start a call of their own
+                if in_flight.get(self.key) is self:
+                    del in_flight[self.key]
+                deadline.hand_over(self.context)
+                self.task.cancel()
+
+    def _done(self, task: asyncio.Task):
+        if in_flight.get(self.key) is self:
+            del in_flight[self.key]
+        # Mark a failure as retrieved even when every caller has gone away
+        if not task.cancelled():
+            task.exception()
+
+
+# Upstream calls currently running, by cache key, so that identical requests
+# arriving while the first one is still running share its result
+in_flight: dict[str, SharedCall] = {}
+
+
+async def predict(
+    body: bytes,
+    model: str,
+    prepared: Callable[[], Awaitable[bytes]] | None = None,
+    hashed: Callable[[], Awaitable[int | None]] | None = None,
+) -> Prediction:
+    # The model version is part of the key so that a model update is never
+    # answered with predictions of the previous version
+    key = cache.key(body, model, torchserve.model_version(model))
+    image_hash = None
+    if settings.prediction_cache_enabled:
+        result = cache.get(key)
+        if result is not None:
+            return result
+        if settings.near_duplicate_enabled:
+            if hashed is None:
+                hashed = preprocessing.image_hash_once(body)
+            image_hash = await hashed()
+        if image_hash is not None:
+            result = near_duplicate(image_hash, key)
+            if result is not None:
+                metrics.NEAR_DUPLICATE_HITS.labels(model).inc()
+                return result
+
+    if prepared is None:
+        prepared = preprocessing.preprocess_once(body)
+    if not settings.prediction_coalescing_enabled:
+        return await fetch(model, prepared, key, image_hash)
+
+    call = in_flight.get(key)
+    if call is None:
+        call = SharedCall(key, fetch(model, prepared, key, image_hash))
+        in_flight[key] = call
+    else:
+        metrics.COALESCED_REQUESTS.labels(model).inc()
+    return await call.wait()
+
+
+def near_duplicate(image_hash: int, key: str) -> Prediction | None:
+    similar = near_duplicates.find(
+        image_hash, near_duplicates.scope(key), settings.near_duplicate_max_distance
+    )
+    if similar is None:
+        return None
+    # The request already counted as a miss of the cache
+    result = cache.peek(similar)
+    if result is None:
+        # Evicted from the cache or expired since
+        near_duplicates.remove(similar)
+    return result
+
+
+async def fetch(
+    model: str,
+    prepared: Callable[[], Awaitable[bytes]],
+    key: str,
+    image_hash: int | None = None,
+) -> Prediction:
+    # Send the file to TorchServe
+    response = await torchserve.infer(model, await prepared())
+
+    # Check if the request was successful
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail=response.text)
+
+    prediction = Prediction(
+        response.content, response.headers.get("content-type", "application/json")
+    )
+    if settings.prediction_cache_enabled:
+        cache.put(key, prediction, len(prediction.content))
+        if image_hash is not None:
+            near_duplicates.add(image_hash, key)
+    return prediction
+
+
+async def predict_result(
+    body: bytes,
+    model: str,
+    prepared: Callable[[], Awaitable[bytes]] | None = None,
+    hashed: Callable[[], Awaitable[int | None]] | None = None,
+) -> dict:
+    # Prediction of a single model or the error it failed with, together with
+    # the time it took, for endpoints that combine several predictions
+    start = time.perf_counter()
+    try:
+        if len(body) > settings.max_request_body_size:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Image exceeds the limit of {settings.max_request_body_size} bytes",
+            )
+        prediction = await predict(body, model, prepared, hashed)
+        # Embedded in the combined response without decoding it
+        result = {"prediction": orjson.Fragment(prediction.content)}
+    except HTTPException as e:
+        result = {"error": e.detail, "status_code": e.status_code}
+    except Exception as e:
+        result = {"error": str(e), "status_code": 500}
+    result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return result
+
+
+async def predict_all(body: bytes, models: list[str]) -> dict:
+    # Query the models concurrently with a single upload of the image. A failing
+    # model is reported in its own entry instead of failing the whole request
+    prepared = preprocessing.preprocess_once(body)
+    hashed = preprocessing.image_hash_once(body)
+    results = await asyncio.gather(
+        *(predict_result(body, model, prepared, hashed) for model in models)
+    )
+    return dict(zip(models, results))
+
+
+async def predict_batch(images: list[tuple[str, bytes]], model: str) -> dict:
+    # Run the images through the model with bounded concurrency. A failing image
+    # is reported in its own entry instead of failing the whole batch
+    semaphore = asyncio.Semaphore(settings.batch_concurrency)
+
+    async def bounded_predict(body):
+        async with semaphore:
+            return await predict_result(body, model)
+
+    results = await asyncio.gather(*(bounded_predict(body) for _, body in images))
+    return {name: result for (name, _), result in zip(images, results)}
+
+
+async def stream_batch(
+    images: list[tuple[str, bytes]], model: str
+) -> AsyncIterator[bytes]:
+    # Like predict_batch, but yields one NDJSON line per image as soon as its
+    # prediction is done, with the index of the image in the upload
+    semaphore = asyncio.Semaphore(settings.batch_concurrency)
+
+    async def bounded_predict(index, body):
+        async with semaphore:
+            return index, await predict_result(body, model)
+
+    tasks = [
+        asyncio.create_task(bounded_predict(index, body))
+        for index, (_, body) in enumerate(images)
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            index, result = await next_done
+            line = {"index": index, "name": images[index][0], **result}
+            yield orjson.dumps(line) + b"\n"
+    finally:
+        # The client went away, the remaining images are not predicted
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,119 @@
+import asyncio
+import io
+import logging
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Awaitable, Callable
+
+from PIL import Image, ImageOps
+
+from crop_health_api.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Pool running the image processing, so that decoding and resizing large
+# pictures never blocks the event loop. Only set when preprocessing or the
+# near-duplicate lookup is enabled.
+executor: Executor | None = None
+
+
+def start():
+    global executor
+    enabled = settings.preprocess_images or settings.near_duplicate_enabled
+    if enabled and executor is None:
+        if settings.preprocess_use_processes:
+            executor = ProcessPoolExecutor(max_workers=settings.preprocess_workers)
+        else:
+            executor = ThreadPoolExecutor(max_workers=settings.preprocess_workers)
+
+
+def stop():
+    global executor
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+        executor = None
+
+
+def resize_image(body: bytes, size: int, quality: int) -> bytes:
+    # Decode the picture, apply its EXIF orientation, scale it down so that its
+    # shorter side is `size` pixels and re-encode it as a compact JPEG
+    with Image.open(io.BytesIO(body)) as image:
+        # Let the JPEG decoder skip detail we are going to throw away anyway
+        image.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        scale = size / min(image.size)
+        if scale < 1:
+            image = image.resize(
+                (round(image.width * scale), round(image.height * scale)),
+                Image.Resampling.BICUBIC,
+            )
+        output = io.BytesIO()
+        image.save(output, "JPEG", quality=quality, optimize=True)
+        return output.getvalue()
+
+
+def perceptual_hash(body: bytes) -> int:
+    # Difference hash: whether each pixel of a tiny grayscale thumbnail is
+    # darker than its right neighbour. It stays the same or nearly so when a
+    # picture is re-encoded, resized or stripped of its metadata.
+    with Image.open(io.BytesIO(body)) as image:
+        image.draft("L", (64, 64))
+        image = ImageOps.exif_transpose(image).convert("L")
+        pixels = image.resize((9, 8), Image.Resampling.BOX).tobytes()
+    value = 0
+    for row in range(8):
+        for column in range(8):
+            left = pixels[row * 9 + column]
+            value = value << 1 | (left < pixels[row * 9 + column + 1])
+    return value
+
+
+async def image_hash(body: bytes) -> int | None:
+    if executor is None:
+        return None
+    try:
+        return await asyncio.get_running_loop().run_in_executor(
+            executor, perceptual_hash, body
+        )
+    except Exception as e:
+        logger.debug("Could not hash image: %s", e)
+        return None
+
+
+async def preprocess(body: bytes) -> bytes:
+    if executor is None or not settings.preprocess_images:
+        return body
+    try:
+        resized = await asyncio.get_running_loop().run_in_executor(
+            executor,
+            resize_image,
+            body,
+            settings.preprocess_image_size,
+            settings.preprocess_jpeg_quality,
+        )
+    except Exception as e:
+        # Let TorchServe answer for pictures we fail to process
+        logger.debug("Could not preprocess image: %s", e)
+        return body
+    return resized if len(resized) < len(body) else body
+
+
+def preprocess_once(body: bytes) -> Callable[[], Awaitable[bytes]]:
+    # Preprocess a picture at most once when it is sent to several models, and
+    # only when one of them actually has to go to TorchServe
+    return _once(lambda: preprocess(body))
+
+
+def image_hash_once(body: bytes) -> Callable[[], Awaitable[int | None]]:
+    return _once(lambda: image_hash(body))
+
+
+def _once(run: Callable[[], Awaitable]) -> Callable[[], Awaitable]:
+    task = None
+
+    def get():
+        nonlocal task
+        if task is None:
+            task = asyncio.ensure_future(run())
+        return task
+
+    return get
@@ -0,0 +1,142 @@
+import io
+import zipfile
+from typing import AsyncIterator
+
+from fastapi import Request
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile
+from starlette.formparsers import MultiPartException, MultiPartParser
+
+from crop_health_api.settings import settings
+
+ZIP_CONTENT_TYPES = ("application/zip", "application/x-zip-compressed")
+
+
+class RequestBodyTooLarge(Exception):
+    def __init__(self, limit: int):
+        super().__init__(f"Request body exceeds the limit of {limit} bytes")
+        self.limit = limit
+
+
+class InvalidBatch(Exception):
+    pass
+
+
+def check_content_length(request: Request, limit: int):
+    # Reject early when the client announces a body that is too large
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit():
+        if int(content_length) > limit:
+            raise RequestBodyTooLarge(limit)
+
+
+async def stream_body(
+    request: Request, limit: int | None = None
+) -> AsyncIterator[bytes]:
+    # Yield the request body chunk by chunk while enforcing the size limit, so
+    # that the whole image never has to be held in memory
+    limit = limit or settings.max_request_body_size
+    check_content_length(request, limit)
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > limit:
+            raise RequestBodyTooLarge(limit)
+        if chunk:
+            yield chunk
+
+
+async def read_body(request: Request, limit: int | None = None) -> bytes:
+    chunks = [chunk async for chunk in stream_body(request, limit)]
+    return b"".join(chunks)
+
+
+async def read_images(request: Request) -> list[tuple[str, bytes]]:
+    # Read the images of a batch, either uploaded as multipart form files or as
+    # a zip archive. Images are read up to one byte past the size limit of a
+    # single image so that oversized images can be reported individually.
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type == "multipart/form-data":
+        images = await _read_multipart(request)
+    elif content_type in ZIP_CONTENT_TYPES:
+        archive = await read_body(request, settings.batch_max_body_size)
+        images = await run_in_threadpool(_read_zip, archive)
+    else:
+        raise InvalidBatch(
+            "Expected a multipart/form-data upload or a zip archive of images"
+        )
+    if not images:
+        raise InvalidBatch("No images found in the request")
+    if len(images) > settings.batch_max_images:
+        raise InvalidBatch(
+            f"Too many images, at most {settings.batch_max_images} are allowed"
+        )
+    return _unique_names(images)
+
+
+async def _read_multipart(request: Request) -> list[tuple[str, bytes]]:
+    parser = MultiPartParser(
+        request.headers,
+        stream_body(request, settings.batch_max_body_size),
+        max_files=settings.batch_max_images,
+    )
+    try:
+        form = await parser.parse()
+    except MultiPartException as e:
+        raise InvalidBatch(e.message)
+    images = []
+    try:
+        for index, (_, value) in enumerate(form.multi_items()):
+            if isinstance(value, UploadFile):
+                name = value.filename or f"image_{index}"
+                images.append(
+                    (name, await value.read(settings.max_request_body_size + 1))
+                )
+    finally:
+        await form.close()
+    return images
+
+
+def _read_zip(archive: bytes) -> list[tuple[str, bytes]]:
+    try:
+        with zipfile.ZipFile(io.BytesIO(archive)) as zip_file:
+            members = [
+                info
+                for info in zip_file.infolist()
+                if not info.is_dir() and not info.filename.startswith("__MACOSX/")
+            ]
+            if len(members) > settings.batch_max_images:
+                raise InvalidBatch(
+                    f"Too many images, at most {settings.batch_max_images} are allowed"
+                )
+            # The decompressed size is bounded like the upload itself, as a
+            # small archive may expand to far more than batch_max_body_size.
+            # file_size comes from the archive and may lie, so each member is
+            # still read at most one byte past the limit of a single image.
+            images = []
+            total = 0
+            for info in members:
+                if total + info.file_size > settings.batch_max_body_size:
+                    raise RequestBodyTooLarge(settings.batch_max_body_size)
+                with zip_file.open(info) as member:
+                    data = member.read(settings.max_request_body_size + 1)
+                total += len(data)
+                if total > settings.batch_max_body_size:
+                    raise RequestBodyTooLarge(settings.batch_max_body_size)
+                images.append((info.filename, data))
+            return images
+    except zipfile.BadZipFile as e:
+        raise InvalidBatch(f"Invalid zip archive: {e}")
+
+
+def _unique_names(images: list[tuple[str, bytes]]) -> list[tuple[str, bytes]]:
+    seen = {}
+    unique = []
+    for name, data in images:
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}#{seen[name]}"
+        else:
+            seen[name] = 0
+        unique.append((name, data))
+    return unique
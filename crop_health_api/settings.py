@@ -1,6 +1,21 @@
+import pathlib
+from typing import Literal
+
+from pydantic import BaseModel, Field
 from pydantic_settings import BaseSettings
 
 
+class ModelConfig(BaseModel):
+    # How TorchServe serves a model, see its management API
+    batch_size: int = 1
+    # Milliseconds TorchServe waits to fill a batch
+    max_batch_delay: int = 100
+    # Seconds after which TorchServe gives up on a prediction
+    response_timeout: int = 120
+    min_workers: int | None = None
+    max_workers: int | None = None
+
+
 class Settings(BaseSettings):
     version: str = "0.0.1"
     title: str = "Crop Health API"
@@ -34,6 +49,117 @@ class Settings(BaseSettings):
         ""
     )
     api_domain: str = "localhost"
+    # OpenAPI document generated at build time by crop_health_api.openapi_artifact
+    openapi_artifact: str = str(pathlib.Path(__file__).parent / "openapi.gen.json")
+    torchserve_max_connections: int = 100
+    torchserve_max_keepalive_connections: int = 20
+    torchserve_keepalive_expiry: float = 30.0
+    torchserve_connect_timeout: float = 5.0
+    torchserve_read_timeout: float = 60.0
+    torchserve_write_timeout: float = 30.0
+    torchserve_pool_timeout: float = 10.0
+    # Transport used for predictions, gRPC falls back to HTTP when unavailable
+    torchserve_transport: Literal["http", "grpc"] = "http"
+    torchserve_grpc_port: int = 7070
+    # Seconds a backend is sent predictions over HTTP after its gRPC port could
+    # not be reached
+    torchserve_grpc_retry_interval: float = 30.0
+    # Budget for a prediction in seconds, clients may set their own with the
+    # X-Request-Timeout header up to request_max_timeout
+    request_timeout: float = 60.0
+    request_max_timeout: float = 300.0
+    # Attempts for a prediction when TorchServe is unreachable or overloaded,
+    # with a random backoff of up to retry_backoff * 2^retry seconds between
+    retry_max_attempts: int = Field(3, ge=1)
+    retry_backoff: float = 0.1
+    # Delay after which a prediction is also sent to another backend, the
+    # first response is used. 0 disables hedging.
+    hedge_delay: float = 0.0
+    # Circuit breaker per model: it opens when at least circuit_error_rate of
+    # the requests in the last circuit_window seconds failed (with at least
+    # circuit_min_requests requests), and lets circuit_half_open_probes
+    # requests through after circuit_open_duration seconds
+    circuit_error_rate: float = 0.5
+    circuit_window: float = 30.0
+    circuit_min_requests: int = 10
+    circuit_open_duration: float = 15.0
+    circuit_half_open_probes: int = 3
+    # Serving configuration of each model, as JSON in the TORCHSERVE_MODELS
+    # environment variable. It is applied through the management API at
+    # startup and every model_reconcile_interval seconds when it has drifted.
+    torchserve_models: dict[str, ModelConfig] = {}
+    model_reconcile_interval: float = 60.0
+    # Seconds between reads of the model versions of each backend, which key
+    # the prediction cache. 0 reads them at startup only.
+    model_version_refresh_interval: float = 60.0
+    # Warm-up of each model before /ping reports ready: sample images (a
+    # synthetic one by default) are sent until two responses in a row take
+    # about as long, at most warmup_max_requests times. 0 disables warm-up.
+    warmup_images: list[str] = []
+    warmup_max_requests: int = 20
+    warmup_tolerance: float = 0.2
+    # Scaling of TorchServe workers per model with the demand in the gateway,
+    # aiming for autoscale_target_concurrency requests per worker. The total
+    # is bounded by autoscale_max_total_workers, typically the CPU cores.
+    autoscale_enabled: bool = False
+    autoscale_interval: float = 5.0
+    autoscale_min_workers: int = 1
+    autoscale_max_workers: int = 4
+    autoscale_max_total_workers: int = 6
+    autoscale_target_concurrency: float = 1.0
+    autoscale_target_latency: float = 1.0
+    autoscale_scale_down_delay: float = 60.0
+    torchserve_management_port: int = 8081
+    # TorchServe backends as "host:port", the local TorchServe by default
+    torchserve_backends: list[str] = []
+    torchserve_backend_weights: dict[str, float] = {}
+    backend_routing: Literal["least_outstanding", "power_of_two", "weighted"] = (
+        "least_outstanding"
+    )
+    # Failed requests in a row after which a backend is ejected until its next
+    # successful health check
+    backend_max_failures: int = 5
+    # Concurrent requests sent to TorchServe per model, and per-model overrides
+    admission_max_concurrency: int = 8
+    admission_model_concurrency: dict[str, int] = {}
+    admission_max_queue: int = 100
+    admission_queue_timeout: float = 10.0
+    admission_retry_after: int = 1
+    # Pipe request bodies straight to TorchServe instead of buffering them
+    torchserve_stream_request_body: bool = False
+    max_request_body_size: int = 20 * 1024 * 1024
+    torchserve_startup_retries: int = 10
+    torchserve_startup_retry_delay: float = 5.0
+    health_check_interval: float = 5.0
+    health_check_timeout: float = 2.0
+    # Cached health results older than this are reported as unhealthy
+    health_max_age: float = 30.0
+    batch_max_images: int = 100
+    batch_max_body_size: int = 200 * 1024 * 1024
+    batch_concurrency: int = 4
+    # Background prediction jobs
+    jobs_workers: int = 2
+    jobs_max_rate: float = 0.0
+    jobs_max_queued_images: int = 10000
+    # Queued images are held in memory until predicted
+    jobs_max_queued_bytes: int = 256 * 1024 * 1024
+    jobs_result_ttl: float = 60 * 60
+    # Downscale and re-encode pictures before sending them to TorchServe
+    preprocess_images: bool = False
+    preprocess_image_size: int = 256
+    preprocess_jpeg_quality: int = 90
+    preprocess_workers: int = 2
+    preprocess_use_processes: bool = False
+    prediction_cache_enabled: bool = True
+    # Share one TorchServe call between identical requests in flight
+    prediction_coalescing_enabled: bool = True
+    prediction_cache_max_bytes: int = 64 * 1024 * 1024
+    prediction_cache_ttl: float = 60 * 60
+    # Answer images whose perceptual hash is at most near_duplicate_max_distance
+    # bits (below 8) away from the one of a cached prediction from the cache
+    near_duplicate_enabled: bool = False
+    near_duplicate_max_distance: int = Field(4, ge=0, lt=8)
+    near_duplicate_max_entries: int = 10000
 
     @property
     def api_url(self):
@@ -0,0 +1,339 @@
+import asyncio
+import logging
+import random
+import time
+from typing import AsyncIterator, Awaitable, Callable
+
+from fastapi import HTTPException
+from httpx import AsyncClient, Limits, Response, Timeout, TransportError
+
+from crop_health_api import (
+    admission,
+    circuit_breaker,
+    deadline,
+    grpc_transport,
+    metrics,
+)
+from crop_health_api.backends import Backend, BackendPool
+from crop_health_api.settings import settings
+
+logger = logging.getLogger(__name__)
+
+MODELS = ("binary", "single-HLT", "multi-HLT")
+
+# Shared client used for all traffic to TorchServe. It is created in the app
+# lifespan so that connections are pooled and kept alive between requests.
+client: AsyncClient | None = None
+# Background task reading the model versions of the backends again
+versions_task: asyncio.Task | None = None
+# Statuses meaning that another attempt may succeed
+RETRYABLE_STATUSES = (502, 503, 504)
+
+
+class BackendDraining(HTTPException):
+    def __init__(self, backend: Backend):
+        super().__init__(
+            status_code=503,
+            detail=f"Models of TorchServe at {backend.address} are being registered",
+            headers={"Retry-After": str(settings.admission_retry_after)},
+        )
+
+
+def torchserve_domain():
+    # If running docker containers locally, use "local_torchserve" given that
+    # it is the name of the container running custom TorchServe
+    if settings.api_domain == "localhost":
+        return "local_torchserve"
+    else:
+        return "localhost"
+
+
+def create_pool() -> BackendPool:
+    addresses = settings.torchserve_backends or [f"{torchserve_domain()}:8080"]
+    return BackendPool(
+        [
+            Backend(
+                address, get_client, settings.torchserve_backend_weights.get(address, 1)
+            )
+            for address in addresses
+        ]
+    )
+
+
+def inference_url(path: str = "") -> str:
+    return pool.primary.inference_url(path)
+
+
+def management_url(path: str = "") -> str:
+    return pool.primary.management_url(path)
+
+
+def open_client() -> AsyncClient:
+    global client, versions_task
+    client = AsyncClient(
+        limits=Limits(
+            max_connections=settings.torchserve_max_connections,
+            max_keepalive_connections=settings.torchserve_max_keepalive_connections,
+            keepalive_expiry=settings.torchserve_keepalive_expiry,
+        ),
+        timeout=Timeout(
+            connect=settings.torchserve_connect_timeout,
+            read=settings.torchserve_read_timeout,
+            write=settings.torchserve_write_timeout,
+            pool=settings.torchserve_pool_timeout,
+        ),
+    )
+    pool.start()
+    if settings.model_version_refresh_interval > 0:
+        versions_task = asyncio.create_task(_refresh_model_versions())
+    return client
+
+
+async def close_client():
+    global client, versions_task
+    if versions_task is not None:
+        versions_task.cancel()
+        versions_task = None
+    await pool.stop()
+    if client is not None:
+        await client.aclose()
+        client = None
+
+
+def get_client() -> AsyncClient:
+    if client is None:
+        raise RuntimeError("TorchServe client is not initialized")
+    return client
+
+
+async def infer(model: str, data: bytes) -> Response:
+    # Predictions are idempotent, so they are retried and hedged within the
+    # deadline of the request
+    return await _guarded(
+        model,
+        lambda: _retry(
+            lambda exclude: _hedge(
+                model,
+                lambda tried, sent: _upstream(
+                    model, lambda backend: _infer(backend, model, data), tried, sent
+                ),
+                exclude,
+            )
+        ),
+    )
+
+
+async def infer_stream(
+    model: str, content: AsyncIterator[bytes], headers: dict
+) -> Response:
+    # Raw body streamed to TorchServe as it arrives, always over HTTP. The
+    # stream can only be consumed once, so it is never retried.
+    return await _guarded(
+        model,
+        lambda: _upstream(
+            model,
+            lambda backend: get_client().post(
+                backend.inference_url(f"/predictions/{model}"),
+                content=content,
+                headers=headers,
+            ),
+        ),
+    )
+
+
+async def _guarded(model: str, call: Callable[[], Awaitable[Response]]) -> Response:
+    async with circuit_breaker.breaker(model).guard() as outcome:
+        try:
+            async with deadline.enforce():
+                response = await call()
+        except TransportError as e:
+            outcome.failed = True
+            raise HTTPException(
+                status_code=502, detail=f"TorchServe is unreachable: {e!r}"
+            )
+        outcome.failed = response.status_code in RETRYABLE_STATUSES
+        return response
+
+
+async def _retry(attempt: Callable[[list[Backend]], Awaitable[Response]]) -> Response:
+    # Backends already tried are avoided by later attempts when possible
+    tried: list[Backend] = []
+    for retry in range(settings.retry_max_attempts):
+        last = retry == settings.retry_max_attempts - 1
+        try:
+            response = await attempt(tried)
+            if response.status_code not in RETRYABLE_STATUSES or last:
+                return response
+            reason = f"status {response.status_code}"
+        except TransportError as e:
+            if last:
+                raise
+            reason = str(e) or repr(e)
+        # Full jitter, so that retries from many requests do not line up
+        delay = random.uniform(0, settings.retry_backoff * 2**retry)
+        left = deadline.remaining()
+        if left is not None and left <= delay:
+            raise deadline.DeadlineExceeded()
+        logger.info("Retrying TorchServe request after %s", reason)
+        metrics.UPSTREAM_RETRIES.labels("retry").inc()
+        await asyncio.sleep(delay)
+
+
+async def _hedge(
+    model: str,
+    attempt: Callable[[list[Backend], asyncio.Event], Awaitable[Response]],
+    tried: list[Backend],
+) -> Response:
+    # After hedge_delay without a response to a request sent to TorchServe, the
+    # same request is sent to another backend and the first usable response
+    # wins. Time spent queued in the gateway does not count, and nothing is
+    # hedged while requests of the model are queued, as a hedge would only
+    # join the queue.
+    sent = asyncio.Event()
+    first = asyncio.create_task(attempt(tried, sent))
+    if settings.hedge_delay <= 0:
+        return await first
+    tasks = {first}
+    try:
+        admitted = asyncio.create_task(sent.wait())
+        try:
+            await asyncio.wait({first, admitted}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            admitted.cancel()
+        done, _ = await asyncio.wait(tasks, timeout=settings.hedge_delay)
+        if not done and not admission.controller(model).waiting:
+            metrics.UPSTREAM_RETRIES.labels("hedge").inc()
+            tasks.add(asyncio.create_task(attempt(tried, asyncio.Event())))
+        while True:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if (
+                    task.exception() is None
+                    and task.result().status_code not in RETRYABLE_STATUSES
+                ):
+                    return task.result()
+            if not tasks:
+                return done.pop().result()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _upstream(
+    model: str,
+    send: Callable[[Backend], Awaitable[Response]],
+    tried: list[Backend] | None = None,
+    sent: asyncio.Event | None = None,
+) -> Response:
+    # Time spent waiting for admission counts as gateway overhead
+    async with admission.controller(model).admit():
+        backend = pool.select(exclude=tried)
+        if backend.draining:
+            # Only picked when no other backend is available, its models may be
+            # unregistered for a moment, as when reconciled at startup
+            raise BackendDraining(backend)
+        if tried is not None:
+            tried.append(backend)
+        backend.outstanding += 1
+        metrics.BACKEND_OUTSTANDING.labels(backend.address).inc()
+        start = time.perf_counter()
+        status = None
+        # Only errors of TorchServe itself count against the backend and in the
+        # upstream metrics, not those of the request like an oversized
+        # streamed body
+        failed = None
+        metrics.upstream_started()
+        if sent is not None:
+            sent.set()
+        try:
+            response = await send(backend)
+            status = response.status_code
+            failed = status in RETRYABLE_STATUSES
+            return response
+        except TransportError:
+            failed = True
+            raise
+        except asyncio.CancelledError:
+            # Either a lost hedge, or TorchServe not answering before the
+            # deadline, which counts against it like a read timeout
+            if deadline.expired():
+                failed = True
+                outcome = circuit_breaker.current_outcome.get()
+                if outcome is not None:
+                    outcome.failed = True
+            raise
+        finally:
+            backend.outstanding -= 1
+            metrics.BACKEND_OUTSTANDING.labels(backend.address).dec()
+            if failed is not None:
+                backend.record(not failed)
+            metrics.upstream_finished(
+                model, time.perf_counter() - start, status, failed is not None
+            )
+
+
+async def _infer(backend: Backend, model: str, data: bytes) -> Response:
+    if backend.grpc is not None and backend.grpc.available:
+        try:
+            return await backend.grpc.predict(
+                model, data, backend.model_versions.get(model, "")
+            )
+        except grpc_transport.TransportUnavailable as e:
+            logger.warning(
+                "gRPC unavailable on %s, using HTTP for %s seconds: %s",
+                backend.address,
+                settings.torchserve_grpc_retry_interval,
+                e,
+            )
+    return await get_client().post(
+        backend.inference_url(f"/predictions/{model}"), files={"data": data}
+    )
+
+
+def model_version(model: str) -> str:
+    # Versions of the model served by the backends. They are joined while the
+    # backends differ, during an upgrade, so that predictions cached for a
+    # version no longer served are not used.
+    versions = {
+        backend.model_versions[model]
+        for backend in pool.backends
+        if model in backend.model_versions
+    }
+    return "|".join(sorted(versions))
+
+
+async def load_model_versions():
+    # Read from every backend, as each may be upgraded on its own
+    await asyncio.gather(
+        *(
+            _load_backend_versions(backend)
+            for backend in pool.backends
+            if backend.monitor.healthy
+        )
+    )
+
+
+async def _load_backend_versions(backend: Backend):
+    for model in MODELS:
+        try:
+            response = await get_client().get(
+                backend.management_url(f"/models/{model}")
+            )
+            response.raise_for_status()
+            backend.model_versions[model] = response.json()[0]["modelVersion"]
+        except Exception as e:
+            logger.warning(
+                "Could not read the version of model %s on %s: %s",
+                model,
+                backend.address,
+                e,
+            )
+
+
+async def _refresh_model_versions():
+    while True:
+        await asyncio.sleep(settings.model_version_refresh_interval)
+        await load_model_versions()
+
+
+pool = create_pool()
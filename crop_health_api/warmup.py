@@ -0,0 +1,110 @@
+import asyncio
+import io
+import itertools
+import logging
+import pathlib
+import time
+
+from PIL import Image
+
+from crop_health_api import torchserve
+from crop_health_api.backends import Backend
+from crop_health_api.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Set once the models have been warmed up, /ping reports not ready until then
+ready = False
+
+
+def sample_images() -> list[bytes]:
+    if settings.warmup_images:
+        return [pathlib.Path(path).read_bytes() for path in settings.warmup_images]
+    # Noise rather than a flat color, so that decoding and inference do the
+    # same work as for a real picture
+    image = Image.effect_noise((256, 256), 64).convert("RGB")
+    output = io.BytesIO()
+    image.save(output, format="JPEG")
+    return [output.getvalue()]
+
+
+async def warm_up_model(backend: Backend, model: str, images: list[bytes]) -> bool:
+    # Sends sample images until two responses in a row take about as long.
+    # Requests go straight to the backend so that they are not cached.
+    start = time.perf_counter()
+    previous = None
+    for request in range(settings.warmup_max_requests):
+        sent = time.perf_counter()
+        try:
+            response = await torchserve.get_client().post(
+                backend.inference_url(f"/predictions/{model}"),
+                files={"data": images[request % len(images)]},
+            )
+        except Exception as e:
+            logger.warning(
+                "Warm-up of model %s on %s failed: %r", model, backend.address, e
+            )
+            return False
+        elapsed = time.perf_counter() - sent
+        if response.status_code != 200:
+            logger.warning(
+                "Warm-up of model %s on %s failed with status %s",
+                model,
+                backend.address,
+                response.status_code,
+            )
+            return False
+        if (
+            previous is not None
+            and abs(elapsed - previous) <= settings.warmup_tolerance * previous
+        ):
+            break
+        previous = elapsed
+    logger.info(
+        "Warmed up model %s on %s with %s requests in %.2f s, the last one took "
+        "%.0f ms",
+        model,
+        backend.address,
+        request + 1,
+        time.perf_counter() - start,
+        elapsed * 1000,
+    )
+    return True
+
+
+async def warm_up_backend(backend: Backend, images: list[bytes]) -> bool:
+    results = await asyncio.gather(
+        *(warm_up_model(backend, model, images) for model in torchserve.MODELS)
+    )
+    return all(results)
+
+
+async def warm_up(max_retries: int | None):
+    # Readiness is only reported once all models of at least one backend have
+    # been warmed up. Retries forever when max_retries is None.
+    global ready
+    if settings.warmup_max_requests <= 0:
+        ready = True
+        return
+    start = time.perf_counter()
+    images = sample_images()
+    attempts = itertools.count() if max_retries is None else range(max_retries)
+    for _ in attempts:
+        backends = [b for b in torchserve.pool.backends if b.monitor.healthy]
+        warmed = await asyncio.gather(
+            *(warm_up_backend(backend, images) for backend in backends)
+        )
+        if any(warmed):
+            logger.info(
+                "Warm-up of %s of %s backends finished in %.2f s",
+                sum(warmed),
+                len(torchserve.pool.backends),
+                time.perf_counter() - start,
+            )
+            ready = True
+            return
+        logger.warning(
+            "No TorchServe backend could be warmed up. Retrying in %s seconds.",
+            settings.torchserve_startup_retry_delay,
+        )
+        await asyncio.sleep(settings.torchserve_startup_retry_delay)